@@ -0,0 +1,103 @@
+"""
+Offline scheduler/calendar benchmark against the in-process fake Calendar
+(services/fake_calendar.py). Uses a throwaway database, never ultron.db.
+
+    python benchmark_scheduler.py --events 2000 --days 28 --latency 0.05,0.15 --error-rate 0.01
+"""
+import argparse
+import datetime
+import random
+import statistics
+import sys
+import os
+import time
+sys.path.append(os.getcwd())
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import database
+
+# Rebind the app's database before anything captures SessionLocal
+database.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=database.engine)
+
+import models
+from services import availability, calendar_integration, calendar_outbox, event_mirror, fake_calendar, gap_cache, quota, scheduler
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--events", type=int, default=1000, help="events seeded into the fake calendar")
+    arg_parser.add_argument("--days", type=int, default=28, help="horizon the events (and the task deadline) span")
+    arg_parser.add_argument("--latency", default="0", help="seconds per request, or min,max")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0)
+    arg_parser.add_argument("--backend", default="memory", help="memory or sqlite:///path")
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--seed", type=int, default=1)
+    return arg_parser.parse_args()
+
+def timed(label, runs, fn):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    print(f"  {label:<34} median {statistics.median(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms")
+
+def main():
+    args = parse_args()
+    backend = fake_calendar.from_url(
+        f"{args.backend}?latency={args.latency}&error_rate={args.error_rate}&error_statuses=429,503&seed={args.seed}"
+    )
+    calendar_integration.set_backend(backend)
+    quota.BACKOFF_BASE = 0.01  # injected errors should cost retries, not wall-clock seconds
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    user = models.User(email="bench@example.com")
+    db.add(user)
+    db.commit()
+    db.add(models.Preference(user_id=user.id))
+    user.google_token = backend.add_account("bench")
+    db.commit()
+
+    # Seed a busy, realistic calendar: 30-120 minute events between 08:00 and 22:00
+    rng = random.Random(args.seed)
+    now = datetime.datetime.now().astimezone()
+    for i in range(args.events):
+        day = now + datetime.timedelta(days=rng.randrange(args.days))
+        start = day.replace(hour=rng.randrange(8, 21), minute=rng.choice([0, 15, 30, 45]), second=0, microsecond=0)
+        backend.add_event("bench", f"Event {i}", start, start + datetime.timedelta(minutes=rng.choice([30, 60, 90, 120])))
+
+    end = now + datetime.timedelta(days=args.days)
+    print(f"{args.events} events over {args.days} days, backend={args.backend}, latency={args.latency}, error_rate={args.error_rate}")
+
+    timed("get_events_for_range (live)", args.runs, lambda: scheduler.get_events_for_range(user, now, end))
+    timed("event_mirror full sync", 1, lambda: event_mirror.sync(db, user))
+    timed("get_events_for_range (mirror)", args.runs, lambda: scheduler.get_events_for_range(user, now, end, db=db))
+    timed("get_busy_for_range (FreeBusy)", args.runs, lambda: scheduler.get_busy_for_range(user, now, end, db=db))
+
+    events = scheduler.get_events_for_range(user, now, end, db=db)
+    prefs = user.preferences
+    timed("get_free_time (gap cache)", args.runs, lambda: scheduler.get_free_time(user, now, end, db, prefs))
+    timed("calculate_free_gaps", args.runs, lambda: scheduler.calculate_free_gaps(now, end, events, prefs))
+    wake_time, sleep_time = scheduler.parse_time_str(prefs.wake_time), scheduler.parse_time_str(prefs.sleep_time)
+    timed("calculate_free_gaps (bitmap)", args.runs, lambda: availability.free_gaps(now, end, events, wake_time, sleep_time))
+
+    def plan():
+        task = models.Task(user_id=user.id, title="Benchmark", total_required_time=600, deadline=end.replace(tzinfo=None))
+        db.add(task)
+        db.commit()
+        scheduler.schedule_task(db, task.id)
+    timed("schedule_task (10h of blocks)", args.runs, plan)
+    timed("calendar_outbox drain", 1, lambda: calendar_outbox.drain(db))
+
+    statuses = [block.sync_status for block in db.query(models.StudyBlock).all()]
+    print(f"  blocks: {len(statuses)} ({statuses.count('synced')} synced, {statuses.count('pending')} pending, {statuses.count('failed')} failed)")
+    print(f"  fake calendar calls: {dict(backend.calls)}")
+    print(f"  quota: {quota.get_stats()}")
+    print(f"  gap cache: {gap_cache.get_stats()}")
+
+if __name__ == "__main__":
+    main()
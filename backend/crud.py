@@ -1,5 +1,7 @@
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 import models, schemas
+from services import gap_cache, weekly_template
 from datetime import datetime
 
 # --- User ---
@@ -45,16 +47,9 @@ def update_preferences(db: Session, user_id: int, preferences: schemas.Preferenc
         db_pref.dinner_time = preferences.dinner_time
         db.commit()
         db.refresh(db_pref)
+        weekly_template.invalidate(user_id)
     return db_pref
 
-def update_user_token(db: Session, user_id: int, token: str):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if db_user:
-        db_user.google_token = token
-        db.commit()
-        db.refresh(db_user)
-    return db_user
-
 # --- Tasks ---
 def get_tasks(db: Session, user_id: int, skip: int = 0, limit: int = 100):
     return db.query(models.Task).filter(models.Task.user_id == user_id).offset(skip).limit(limit).all()
@@ -164,13 +159,16 @@ def create_fixed_schedule(db: Session, schedule: schemas.FixedScheduleCreate, us
     db.add(db_schedule)
     db.commit()
     db.refresh(db_schedule)
+    weekly_template.invalidate(user_id)
     return db_schedule
 
 def delete_fixed_schedule(db: Session, schedule_id: int):
     db_schedule = db.query(models.FixedSchedule).filter(models.FixedSchedule.id == schedule_id).first()
     if db_schedule:
+        user_id = db_schedule.user_id
         db.delete(db_schedule)
         db.commit()
+        weekly_template.invalidate(user_id)
     return db_schedule
 
 # --- Study Blocks ---
@@ -180,6 +178,20 @@ def get_study_block(db: Session, block_id: int):
 def get_study_blocks_for_task(db: Session, task_id: int):
     return db.query(models.StudyBlock).filter(models.StudyBlock.task_id == task_id).all()
 
+def get_study_minutes_by_day(db: Session, user_id: int, start: datetime, end: datetime):
+    """
+    Minutes of study blocks per day for blocks starting in [start, end) (naive local times),
+    as {date: minutes}, from one GROUP BY over the start_time index.
+    """
+    day = func.date(models.StudyBlock.start_time)
+    minutes = func.sum((func.julianday(models.StudyBlock.end_time) - func.julianday(models.StudyBlock.start_time)) * 1440)
+    rows = db.query(day, minutes).join(models.Task).filter(
+        models.Task.user_id == user_id,
+        models.StudyBlock.start_time >= start,
+        models.StudyBlock.start_time < end
+    ).group_by(day).all()
+    return {datetime.strptime(date_str, "%Y-%m-%d").date(): int(round(total or 0)) for date_str, total in rows}
+
 
 # --- Daily Overrides ---
 def get_daily_overrides(db: Session, user_id: int, date: str = None):
@@ -189,6 +201,21 @@ def get_daily_overrides(db: Session, user_id: int, date: str = None):
         query = query.filter(models.DailyOverride.date == date)
     return query.all()
 
+def get_daily_overrides_for_range(db: Session, user_id: int, start_date: str, end_date: str):
+    """
+    Get every override between two dates (YYYY-MM-DD, inclusive) in one query.
+    Returns {date: {override_type: value}}; dates without overrides are absent.
+    """
+    overrides = db.query(models.DailyOverride).filter(
+        models.DailyOverride.user_id == user_id,
+        models.DailyOverride.date >= start_date,
+        models.DailyOverride.date <= end_date
+    ).all()
+    by_date = {}
+    for override in overrides:
+        by_date.setdefault(override.date, {})[override.override_type] = override.value
+    return by_date
+
 def set_daily_override(db: Session, user_id: int, date: str, override_type: str, value: str, note: str = None):
     """Set or update a daily override for a specific date"""
     # Check if override already exists for this date and type
@@ -232,4 +259,5 @@ def clear_daily_overrides_for_date(db: Session, user_id: int, date: str):
         models.DailyOverride.date == date
     ).delete()
     db.commit()
+    gap_cache.bump(user_id)
 
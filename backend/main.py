@@ -1,10 +1,12 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
-from database import engine, Base
-import models
-from routers import tasks, preferences, auth, schedule, chat
+from database import engine, Base, SessionLocal
+import models, crud
+from routers import tasks, preferences, auth, schedule, chat, webhooks
+from services import quota, calendar_outbox, calendar_integration, calendar_watch, fake_calendar
 from fastapi.middleware.cors import CORSMiddleware
 
 from fastapi.staticfiles import StaticFiles
@@ -13,7 +15,30 @@ import os
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Ultron Prototype Mark II", version="0.2.0")
+# Offline mode: serve Calendar calls from an in-process fake instead of Google
+# (e.g. CALENDAR_BACKEND=memory, see services/fake_calendar.from_url)
+if os.environ.get("CALENDAR_BACKEND"):
+    calendar_integration.set_backend(fake_calendar.from_url(os.environ["CALENDAR_BACKEND"]))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if calendar_integration.get_backend() is not None:
+        db = SessionLocal()
+        try:
+            user = crud.get_user(db, 1) # Hardcoded user
+            if user:
+                fake_calendar.connect_user(db, user)
+        finally:
+            db.close()
+    # Pushes queued study blocks to Google Calendar in the background
+    calendar_outbox.start_worker()
+    # Renews push channels before they expire
+    calendar_watch.start_worker()
+    yield
+    calendar_watch.stop_worker()
+    calendar_outbox.stop_worker()
+
+app = FastAPI(title="Ultron Prototype Mark II", version="0.2.0", lifespan=lifespan)
 
 # Mount uploads directory
 os.makedirs("uploads", exist_ok=True)
@@ -33,6 +58,7 @@ app.include_router(preferences.router)
 app.include_router(auth.router)
 app.include_router(schedule.router)
 app.include_router(chat.router)
+app.include_router(webhooks.router)
 
 @app.get("/")
 def read_root():
@@ -40,4 +66,4 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "system": "Ultron Mark II"}
+    return {"status": "healthy", "system": "Ultron Mark II", "calendar_quota": quota.get_stats()}
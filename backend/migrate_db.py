@@ -20,6 +20,42 @@ if 'dinner_time' not in columns:
 else:
     print("dinner_time already exists")
 
+cursor.execute("PRAGMA table_info(study_blocks)")
+block_columns = [col[1] for col in cursor.fetchall()]
+
+if 'sync_status' not in block_columns:
+    cursor.execute('ALTER TABLE study_blocks ADD COLUMN sync_status TEXT')
+    # Blocks created before the outbox were pushed synchronously
+    cursor.execute("UPDATE study_blocks SET sync_status = 'synced' WHERE google_event_id IS NOT NULL")
+    print("Added sync_status column")
+else:
+    print("sync_status already exists")
+
+# The calendar mirror became per-calendar. It is only a cache, so drop it and
+# let the next read run a full sync (the tables are recreated on startup).
+cursor.execute("PRAGMA table_info(calendar_sync_state)")
+sync_columns = [col[1] for col in cursor.fetchall()]
+
+if sync_columns and 'calendar_id' not in sync_columns:
+    cursor.execute('DROP TABLE calendar_sync_state')
+    cursor.execute('DROP TABLE IF EXISTS calendar_events')
+    print("Dropped calendar mirror tables (rebuilt per calendar on next sync)")
+else:
+    print("calendar mirror tables are up to date")
+
+# The mirror's full sync became bounded in the future too (window_end); rows
+# without one are re-synced with a bounded window on the next read.
+if sync_columns and 'calendar_id' in sync_columns and 'window_end' not in sync_columns:
+    cursor.execute('ALTER TABLE calendar_sync_state ADD COLUMN window_end DATETIME')
+    print("Added window_end column")
+
+cursor.execute('CREATE INDEX IF NOT EXISTS ix_daily_overrides_user_date ON daily_overrides (user_id, date)')
+print("daily_overrides (user_id, date) index is in place")
+
+cursor.execute('CREATE INDEX IF NOT EXISTS ix_study_blocks_task_id ON study_blocks (task_id)')
+cursor.execute('CREATE INDEX IF NOT EXISTS ix_study_blocks_start_time ON study_blocks (start_time)')
+print("study_blocks indexes are in place")
+
 conn.commit()
 conn.close()
 print("Migration complete!")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -56,11 +56,12 @@ class StudyBlock(Base):
     __tablename__ = "study_blocks"
 
     id = Column(Integer, primary_key=True, index=True)
-    task_id = Column(Integer, ForeignKey("tasks.id"))
+    task_id = Column(Integer, ForeignKey("tasks.id"), index=True)
     
-    start_time = Column(DateTime)
+    start_time = Column(DateTime, index=True) # indexed for the per-day study load (crud.get_study_minutes_by_day)
     end_time = Column(DateTime)
     google_event_id = Column(String, nullable=True) # ID of the event in Google Calendar
+    sync_status = Column(String, nullable=True) # pending, synced, failed (None: not pushed to Google)
     
     task = relationship("Task", back_populates="study_blocks")
 
@@ -108,6 +109,8 @@ class FixedSchedule(Base):
 class DailyOverride(Base):
     """Temporary overrides for specific dates (e.g., leaving early, skipping commute)"""
     __tablename__ = "daily_overrides"
+    # The scheduler loads a user's overrides for a whole date range at once
+    __table_args__ = (Index("ix_daily_overrides_user_date", "user_id", "date"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -118,3 +121,68 @@ class DailyOverride(Base):
     note = Column(String, nullable=True)  # Optional note
     
     user = relationship("User", back_populates="daily_overrides")
+
+
+class CalendarEvent(Base):
+    """Local mirror of the user's Google Calendar events (kept current via syncToken)"""
+    __tablename__ = "calendar_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    calendar_id = Column(String, default="primary", index=True)  # "primary" or the calendarList ID
+    
+    google_event_id = Column(String, index=True)
+    summary = Column(String, nullable=True)
+    start_time = Column(DateTime, index=True)  # UTC (all-day events: midnight of the start date)
+    end_time = Column(DateTime, index=True)  # UTC (all-day events: midnight of the end date, exclusive)
+    is_all_day = Column(Boolean, default=False)
+    raw = Column(String)  # Event resource JSON as returned by Google
+
+
+class CalendarSyncState(Base):
+    """Per-calendar sync bookkeeping for the calendar mirror"""
+    __tablename__ = "calendar_sync_state"
+    __table_args__ = (UniqueConstraint("user_id", "calendar_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    calendar_id = Column(String, default="primary")  # "primary" or the calendarList ID
+    
+    sync_token = Column(String, nullable=True)  # Google's nextSyncToken
+    window_start = Column(DateTime, nullable=True)  # UTC; the mirror holds no events before this
+    window_end = Column(DateTime, nullable=True)  # UTC; ... nor after this
+    last_synced_at = Column(DateTime, nullable=True)  # UTC; None means "stale, sync on next read"
+
+
+class CalendarWatchChannel(Base):
+    """Google Calendar push-notification channel (events.watch) for a user"""
+    __tablename__ = "calendar_watch_channels"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    
+    channel_id = Column(String, unique=True, index=True)  # Our UUID, echoed back in X-Goog-Channel-ID
+    resource_id = Column(String)  # Google's ID for the watched resource (needed to stop the channel)
+    token = Column(String)  # Shared secret, echoed back in X-Goog-Channel-Token
+    expiration = Column(DateTime)  # UTC
+    last_message_number = Column(Integer, default=0)
+
+
+
+class CalendarOutbox(Base):
+    """Pending Google Calendar mutation, written in the same transaction as the local change"""
+    __tablename__ = "calendar_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    study_block_id = Column(Integer, ForeignKey("study_blocks.id"), nullable=True, index=True)
+    
+    op = Column(String)  # insert, update, delete
+    payload = Column(String)  # JSON: summary/description for inserts, event_id for deletes
+    idempotency_key = Column(String, unique=True, index=True)  # Inserts use it as the Google event ID
+    status = Column(String, default="pending", index=True)  # pending, done, failed, cancelled
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow)  # UTC
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
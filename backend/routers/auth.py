@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from database import get_db
-from services import calendar_integration
+from services import calendar_integration, event_mirror, calendar_watch
 import crud
 import json
 from fastapi.responses import RedirectResponse
@@ -31,6 +31,13 @@ def google_auth_callback(code: str, db: Session = Depends(get_db)):
         
         # Save to DB
         crud.update_user_token(db, USER_ID, creds_json)
+        # The new token may belong to a different Google account
+        event_mirror.clear(db, USER_ID)
+        # Subscribe to change notifications (no-op unless GOOGLE_WEBHOOK_URL is set)
+        try:
+            calendar_watch.ensure_watch(db, crud.get_user(db, USER_ID))
+        except Exception as e:
+            print(f"Failed to start calendar watch channel: {e}")
         
         # Redirect back to frontend settings page
         return RedirectResponse(url="http://localhost:3000/settings?connected=true")
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from database import get_db
-from services import scheduler, calendar_integration
+from services import scheduler, event_mirror, calendar_outbox
 import crud
 import schemas
 from typing import List
+from datetime import datetime
 
 router = APIRouter(
     prefix="/schedule",
@@ -21,24 +22,65 @@ def schedule_task_endpoint(task_id: int, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/all")
+def schedule_all_tasks_endpoint(db: Session = Depends(get_db)):
+    """Plans every pending/underplanned task in one pass (earliest deadline first)."""
+    try:
+        return scheduler.schedule_all_tasks(db, user_id=1)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/replan")
+def replan_interval_endpoint(start: str, end: str, db: Session = Depends(get_db)):
+    """Moves only the study blocks overlapping [start, end) (ISO strings), e.g. after adding an event there."""
+    try:
+        return scheduler.replan_interval(db, 1, datetime.fromisoformat(start), datetime.fromisoformat(end))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/task/{task_id}/sync")
+def get_task_sync_status(task_id: int, db: Session = Depends(get_db)):
+    """Google Calendar sync state of each of the task's study blocks (pending, synced, failed)."""
+    task = crud.get_task(db, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    blocks = sorted(task.study_blocks, key=lambda b: b.start_time)
+    return calendar_outbox.block_sync_status(db, blocks)
+
+@router.get("/blocks/{block_id}/sync")
+def get_block_sync_status(block_id: int, db: Session = Depends(get_db)):
+    block = crud.get_study_block(db, block_id)
+    if not block:
+        raise HTTPException(status_code=404, detail="Study block not found")
+    return calendar_outbox.block_sync_status(db, [block])[0]
+
+@router.post("/blocks/{block_id}/sync")
+def retry_block_sync(block_id: int, db: Session = Depends(get_db)):
+    """Retries pushing a block whose Google Calendar sync failed."""
+    block = crud.get_study_block(db, block_id)
+    if not block:
+        raise HTTPException(status_code=404, detail="Study block not found")
+    if not calendar_outbox.requeue_block(db, block):
+        raise HTTPException(status_code=400, detail="Block has no failed sync to retry")
+    return calendar_outbox.block_sync_status(db, [block])[0]
+
 @router.get("/events")
-def get_events(start: str, end: str, db: Session = Depends(get_db)):
+def get_events(start: str, end: str, refresh: bool = False, db: Session = Depends(get_db)):
     """
     Get all events (Google + Ultron) for a specific range.
     start/end should be ISO strings.
+    Served from the local calendar mirror; pass refresh=true to force a sync first.
     """
     user = crud.get_user(db, 1) # Hardcoded user
     if not user or not user.google_token:
         return []
     
     try:
-        events = calendar_integration.list_events(
-            user.google_token, 
-            time_min=start, 
-            time_max=end,
-            db=db,
-            user_id=user.id
-        )
+        events = event_mirror.get_events(db, user, start, end, force_refresh=refresh)
         return events
     except Exception as e:
         error_msg = str(e)
@@ -59,6 +101,16 @@ def get_conflicts(db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/conflicts/resolve")
+def resolve_conflicts(db: Session = Depends(get_db)):
+    """Moves every conflicting study block to a free slot in one pass."""
+    try:
+        return scheduler.resolve_conflicts(db, 1) # Hardcoded user
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/fixed", response_model=List[schemas.FixedSchedule])
 def get_fixed_schedules(db: Session = Depends(get_db)):
     return crud.get_fixed_schedules(db, user_id=1)
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List
 import crud, schemas
 from database import get_db
+from services import calendar_outbox
 
 router = APIRouter(
     prefix="/tasks",
@@ -31,5 +32,11 @@ def update_task(task_id: int, task: schemas.TaskUpdate, db: Session = Depends(ge
 
 @router.delete("/{task_id}")
 def delete_task(task_id: int, db: Session = Depends(get_db)):
+    task = crud.get_task(db, task_id)
+    user = crud.get_user(db, task.user_id) if task else None
+    # Remove the study blocks' Google events along with the task
+    queued = calendar_outbox.enqueue_task_delete(db, user.id, task) if user and user.google_token else 0
     crud.delete_task(db, task_id=task_id)
+    if queued:
+        calendar_outbox.wake()
     return {"ok": True}
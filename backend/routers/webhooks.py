@@ -0,0 +1,59 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response
+from sqlalchemy.orm import Session
+from database import get_db
+from services import calendar_watch
+import crud
+
+router = APIRouter(
+    prefix="/webhooks",
+    tags=["webhooks"],
+)
+
+# Hardcoded user_id for prototype
+USER_ID = 1
+
+@router.post("/google/calendar")
+def google_calendar_notification(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """
+    Receives Google Calendar push notifications (events.watch channels).
+    Invalidates the cached calendar data right away and pulls the delta in the background.
+    """
+    headers = request.headers
+    try:
+        user_id = calendar_watch.handle_notification(
+            db,
+            channel_id=headers.get("X-Goog-Channel-ID"),
+            channel_token=headers.get("X-Goog-Channel-Token"),
+            resource_state=headers.get("X-Goog-Resource-State"),
+            message_number=headers.get("X-Goog-Message-Number")
+        )
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    
+    if user_id:
+        background_tasks.add_task(calendar_watch.refresh_user, user_id)
+    # Google only needs a 2xx; anything else makes it retry
+    return Response(status_code=200)
+
+@router.post("/google/calendar/watch")
+def start_calendar_watch(db: Session = Depends(get_db)):
+    """Starts (or renews) the push channel for the user's primary calendar."""
+    user = crud.get_user(db, USER_ID)
+    if not user or not user.google_token:
+        raise HTTPException(status_code=400, detail="Google Calendar not connected")
+    
+    try:
+        channel = calendar_watch.ensure_watch(db, user)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not channel:
+        raise HTTPException(status_code=400, detail="GOOGLE_WEBHOOK_URL is not configured")
+    return {"channel_id": channel.channel_id, "expiration": channel.expiration.isoformat()}
+
+@router.delete("/google/calendar/watch")
+def stop_calendar_watch(db: Session = Depends(get_db)):
+    user = crud.get_user(db, USER_ID)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    stopped = calendar_watch.stop_watch(db, user)
+    return {"status": "success", "channels_stopped": stopped}
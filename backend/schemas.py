@@ -26,6 +26,7 @@ class StudyBlockBase(BaseModel):
     start_time: datetime
     end_time: datetime
     google_event_id: Optional[str] = None
+    sync_status: Optional[str] = None
 
 class StudyBlockCreate(StudyBlockBase):
     pass
@@ -0,0 +1,70 @@
+import datetime
+import numpy as np
+
+# Minute-resolution availability engine for long planning horizons.
+# The range is one array of minutes starting at midnight of the first day.
+# Awake windows and busy intervals (events, commute, dinner, study blocks) are
+# rasterized into it with a difference array and a cumulative sum, and the free
+# runs are read back with np.diff. The cost is O(events + minutes), whatever
+# the events look like, which keeps multi-week queries predictable.
+#
+# Times are snapped outwards to whole minutes (busy starts down, busy ends up;
+# the range start up, its end down), so a gap is never reported where there is
+# busy time.
+
+
+def _minute_index(origin: datetime.datetime, moments):
+    """Minutes from origin to each moment, as a float array (callers floor or ceil)."""
+    return np.fromiter(((moment - origin).total_seconds() for moment in moments), dtype=np.float64, count=len(moments)) / 60.0
+
+def _coverage(size, starts, ends):
+    """How many of the [start, end) index intervals cover each of `size` minutes (difference array + cumsum)."""
+    keep = ends > starts
+    edges = np.bincount(starts[keep], minlength=size + 1) - np.bincount(ends[keep], minlength=size + 1)
+    return np.cumsum(edges[:size])
+
+def free_gaps(start_dt: datetime.datetime, end_dt: datetime.datetime, existing_events: list, wake_time: datetime.time, sleep_time: datetime.time):
+    """Same contract as scheduler.calculate_free_gaps: per-day (start, end) gaps between wake and sleep, in start_dt's timezone."""
+    if end_dt <= start_dt:
+        return []
+    tz = start_dt.tzinfo
+    first_day = start_dt.date()
+    days = [first_day + datetime.timedelta(days=i) for i in range((end_dt.date() - first_day).days + 1)]
+    origin = datetime.datetime.combine(first_day, datetime.time()).replace(tzinfo=tz)
+    if tz is not None:
+        # Subtracting datetimes that share a tzinfo ignores DST changes; counting from UTC does not
+        origin = origin.astimezone(datetime.timezone.utc)
+    horizon = int(np.ceil(_minute_index(origin, [end_dt])[0]))
+    window_start = max(0, int(np.ceil(_minute_index(origin, [start_dt])[0])))
+    window_end = int(np.floor(_minute_index(origin, [end_dt])[0]))
+
+    # Awake windows, one per day (none on days where sleep is not after wake, like the per-day engine)
+    awake = np.zeros(horizon, dtype=np.int64)
+    if wake_time < sleep_time:
+        wakes = [datetime.datetime.combine(day, wake_time).replace(tzinfo=tz) for day in days]
+        sleeps = [datetime.datetime.combine(day, sleep_time).replace(tzinfo=tz) for day in days]
+        starts = np.clip(np.ceil(_minute_index(origin, wakes)).astype(np.int64), window_start, window_end)
+        ends = np.clip(np.floor(_minute_index(origin, sleeps)).astype(np.int64), window_start, window_end)
+        awake = _coverage(horizon, starts, ends)
+
+    # Busy time
+    busy = np.zeros(horizon, dtype=np.int64)
+    if existing_events:
+        starts = np.clip(np.floor(_minute_index(origin, [event['start'] for event in existing_events])).astype(np.int64), 0, horizon)
+        ends = np.clip(np.ceil(_minute_index(origin, [event['end'] for event in existing_events])).astype(np.int64), 0, horizon)
+        busy = _coverage(horizon, starts, ends)
+
+    free = (awake > 0) & (busy == 0)
+
+    # Runs of free minutes: +1 where one starts, -1 where one ends
+    edges = np.diff(np.concatenate(([0], free.view(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    gaps = []
+    for start, end in zip(run_starts.tolist(), run_ends.tolist()):
+        gap_start = origin + datetime.timedelta(minutes=start)
+        gap_end = origin + datetime.timedelta(minutes=end)
+        if tz is not None:
+            gap_start, gap_end = gap_start.astimezone(tz), gap_end.astimezone(tz)
+        gaps.append((gap_start, gap_end))
+    return gaps
@@ -0,0 +1,241 @@
+import asyncio
+import datetime
+import functools
+import threading
+from urllib.parse import quote
+import httpx
+from services import calendar_integration, quota
+
+# Asyncio-native Google Calendar client.
+# Implements calendar_integration's reads and deletes (list_events,
+# list_event_changes, delete_event) as coroutines that share one pooled keep-alive
+# HTTP client; the sync functions there delegate here. Credentials come from
+# calendar_integration's per-user cache.
+#
+# The client lives on a dedicated event loop thread so that sync code (routers,
+# the streaming chat generator) and async code share the same connection pool:
+# sync callers use run_sync(), async callers simply await the coroutines.
+
+API_BASE = "https://www.googleapis.com/calendar/v3"
+
+# Upper bound on in-flight Google requests across the whole process
+MAX_CONCURRENCY = 8
+
+LIMITS = httpx.Limits(max_connections=MAX_CONCURRENCY * 2, max_keepalive_connections=MAX_CONCURRENCY, keepalive_expiry=60)
+TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+_loop = None
+_client = None
+_client_backend = None  # the calendar_integration backend _client was built for
+_semaphore = None
+_init_lock = threading.Lock()
+
+
+def _ensure_loop():
+    """Starts the background event loop on first use."""
+    global _loop, _semaphore
+    if _loop is not None:
+        return _loop
+    with _init_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="calendar-async", daemon=True).start()
+
+            async def init():
+                return asyncio.Semaphore(MAX_CONCURRENCY)
+
+            _semaphore = asyncio.run_coroutine_threadsafe(init(), loop).result()
+            _loop = loop
+    return _loop
+
+async def _get_client():
+    """The pooled client (created on the loop), rebuilt when calendar_integration.set_backend swaps the backend."""
+    global _client, _client_backend
+    # With a fake backend plugged in, requests never leave the process
+    backend = calendar_integration.get_backend()
+    if _client is None or backend is not _client_backend:
+        previous = _client
+        transport = backend.transport() if backend is not None else None
+        _client = httpx.AsyncClient(base_url=API_BASE, limits=LIMITS, timeout=TIMEOUT, transport=transport)
+        _client_backend = backend
+        if previous is not None:
+            await previous.aclose()
+    return _client
+
+def submit(coro):
+    """Starts a coroutine on the client's loop and returns its concurrent.futures.Future (for sync callers that overlap work)."""
+    return asyncio.run_coroutine_threadsafe(coro, _ensure_loop())
+
+def run_sync(coro):
+    """Runs a coroutine on the client's loop and blocks until it finishes (for sync callers)."""
+    return submit(coro).result()
+
+def _on_client_loop(func):
+    """Decorator: always execute the coroutine on the client's loop, whichever loop awaits it."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = _ensure_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return await func(*args, **kwargs)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(func(*args, **kwargs), loop))
+    return wrapper
+
+def _error_reason(response):
+    try:
+        errors = response.json()['error'].get('errors') or [{}]
+        return errors[0].get('reason')
+    except Exception:
+        return None
+
+async def _request(token_json, method, path, **kwargs):
+    """
+    Sends one authorized request through the shared pool, bounded by MAX_CONCURRENCY.
+    Shares the per-user token bucket and retry policy with the sync client (services/quota.py).
+    """
+    # Credentials are cached per user; a refresh (rare) is a blocking call, so push it off the loop.
+    # Callers refresh up front with calendar_integration.refresh_token, which saves the new token on
+    # their session; one that still happens here has no session and is saved by the token manager.
+    creds, _ = await asyncio.to_thread(calendar_integration.get_credentials, token_json)
+    headers = kwargs.pop('headers', {})
+    headers['Authorization'] = f"Bearer {creds.token}"
+    bucket = calendar_integration.get_rate_limiter(token_json)
+
+    for attempt in range(quota.MAX_RETRIES + 1):
+        wait = bucket.reserve()
+        if wait > 0:
+            quota.record('throttled_seconds', wait)
+            await asyncio.sleep(wait)
+        quota.record('requests')
+
+        client = await _get_client()
+        try:
+            async with _semaphore:
+                response = await client.request(method, path, headers=headers, **kwargs)
+        except httpx.TransportError:
+            # Timeouts and dropped connections (httpx.TimeoutException is one)
+            if attempt == quota.MAX_RETRIES:
+                quota.record('failures')
+                raise
+            quota.record('network_errors')
+            quota.record('retries')
+            await asyncio.sleep(quota.backoff_delay(attempt))
+            continue
+
+        kind = quota.classify(response.status_code, _error_reason(response)) if response.is_error else None
+        if kind is None or attempt == quota.MAX_RETRIES:
+            break
+        quota.record(kind)
+        quota.record('retries')
+        delay = quota.backoff_delay(attempt, response.headers.get('retry-after'))
+        if kind == 'rate_limited':
+            bucket.penalize(delay)
+        else:
+            await asyncio.sleep(delay)
+
+    if response.is_error:
+        quota.record('failures')
+    response.raise_for_status()
+    if response.status_code == 204 or not response.content:
+        return None
+    return response.json()
+
+def _events_path(calendar_id='primary', event_id=None):
+    # Calendar IDs are e-mail-like and may contain '#' (e.g. holiday calendars)
+    path = f"/calendars/{quote(calendar_id, safe='')}/events"
+    if event_id:
+        path += f"/{event_id}"
+    return path
+
+def list_params(time_min=None, time_max=None, fields=None):
+    """Query parameters for an events.list range request (see list_events_page)."""
+    if not time_min:
+        time_min = datetime.datetime.utcnow().isoformat() + 'Z'
+
+    params = {
+        'timeMin': time_min,
+        'singleEvents': 'true',
+        'orderBy': 'startTime',
+        'maxResults': calendar_integration.PAGE_SIZE,
+    }
+    if time_max:
+        params['timeMax'] = time_max
+    if fields:
+        params['fields'] = fields
+    return params
+
+@_on_client_loop
+async def list_events_page(token_json, params, page_token=None, calendar_id='primary'):
+    """Fetches one page of events. Returns (events, next_page_token or None)."""
+    if page_token:
+        params = dict(params, pageToken=page_token)
+    result = await _request(token_json, 'GET', _events_path(calendar_id), params=params)
+    events = result.get('items', [])
+    for event in events:
+        calendar_integration.remember_etag(token_json, event)
+    return events, result.get('nextPageToken')
+
+@_on_client_loop
+async def list_events(token_json, time_min=None, time_max=None, fields=None, calendar_id='primary'):
+    """Lists events from one calendar (the primary by default, all pages)."""
+    params = list_params(time_min, time_max, fields)
+    events = []
+    page_token = None
+    while True:
+        page, page_token = await list_events_page(token_json, params, page_token, calendar_id)
+        events.extend(page)
+        if not page_token:
+            return events
+
+@_on_client_loop
+async def list_event_changes(token_json, sync_token=None, time_min=None, fields=calendar_integration.MIRROR_FIELDS, calendar_id='primary', time_max=None):
+    """Async twin of calendar_integration.list_event_changes. Returns (events, next_sync_token)."""
+    params = {'singleEvents': 'true', 'maxResults': calendar_integration.PAGE_SIZE}
+    if fields:
+        params['fields'] = fields
+    if sync_token:
+        params['syncToken'] = sync_token
+    else:
+        if time_min:
+            params['timeMin'] = time_min
+        if time_max:
+            params['timeMax'] = time_max
+
+    events = []
+    while True:
+        try:
+            result = await _request(token_json, 'GET', _events_path(calendar_id), params=params)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 410:
+                raise calendar_integration.SyncTokenExpired("Sync token is no longer valid.")
+            raise
+        for event in result.get('items', []):
+            calendar_integration.remember_etag(token_json, event)
+            events.append(event)
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return events, result.get('nextSyncToken')
+        params['pageToken'] = page_token
+
+@_on_client_loop
+async def delete_event(token_json, event_id):
+    """Deletes an event from the primary calendar."""
+    await _request(token_json, 'DELETE', _events_path(event_id=event_id))
+    calendar_integration.forget_etag(token_json, event_id)
+    return True
+
+# --- Concurrent helpers ---
+
+@_on_client_loop
+async def list_events_for_calendars(token_json, calendar_ids, time_min=None, time_max=None, fields=None):
+    """
+    Fetches the same range from several calendars concurrently, so the total time is that of the slowest one.
+    Returns one result per calendar: its event list, or the exception it failed with.
+    """
+    return await asyncio.gather(*[
+        list_events(token_json, time_min=time_min, time_max=time_max, fields=fields, calendar_id=calendar_id)
+        for calendar_id in calendar_ids
+    ], return_exceptions=True)
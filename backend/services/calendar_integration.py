@@ -1,10 +1,19 @@
 import os
 import json
+import socket
+import threading
+import time
+import uuid
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+import httplib2
 import datetime
+from dateutil import parser
+from services import quota
 
 # Scopes required for the app
 SCOPES = ['https://www.googleapis.com/auth/calendar', 'https://www.googleapis.com/auth/calendar.events']
@@ -42,61 +51,490 @@ def credentials_to_dict(credentials):
         'token_uri': credentials.token_uri,
         'client_id': credentials.client_id,
         'client_secret': credentials.client_secret,
-        'scopes': credentials.scopes
+        'scopes': credentials.scopes,
+        # Without a stored expiry google-auth treats every loaded token as expired
+        'expiry': credentials.expiry.isoformat() + 'Z' if credentials.expiry else None
     }
 
-def get_service(token_json):
-    """Builds the Google Calendar service from stored token JSON.
+# --- Service Cache ---
+# Building a Calendar client (parsing the discovery document, wiring up the
+# authorized transport) is far more expensive than the API call itself, so we
+# build it once per user and reuse it until the stored token changes.
+# httplib2 connections are not thread-safe, so each worker thread gets its own
+# service object on top of the shared credentials.
+_discovery_doc = None
+_discovery_lock = threading.Lock()
+_service_cache = {}  # user key -> cache entry (see _get_cache_entry)
+_service_cache_lock = threading.Lock()
+
+def _get_discovery_doc():
+    """Loads the Calendar v3 discovery document shipped on disk with googleapiclient (parsed once)."""
+    global _discovery_doc
+    if _discovery_doc is None:
+        with _discovery_lock:
+            if _discovery_doc is None:
+                doc = discovery_cache.get_static_doc('calendar', 'v3')
+                _discovery_doc = json.loads(doc) if doc else False
+    return _discovery_doc
+
+def _user_key(creds_data):
+    """Stable per-user cache key. The refresh token survives access token refreshes."""
+    return creds_data.get('refresh_token') or creds_data.get('token')
+
+def _get_cache_entry(token_json):
+    """Returns the cache entry for this token, rebuilding it if the user re-authenticated."""
+    creds_data = json.loads(token_json)
+    key = _user_key(creds_data)
     
-    Returns: (service, new_token_json or None)
-    - If token was refreshed, returns the new token JSON to be saved
-    - If no refresh needed, returns None as second value
+    with _service_cache_lock:
+        entry = _service_cache.get(key)
+        # A token we built from, or one we refreshed ourselves, is still ours.
+        # Anything else means the stored credentials were replaced.
+        if entry is None or token_json not in entry['known_tokens']:
+            entry = {
+                'creds': Credentials.from_authorized_user_info(creds_data, SCOPES),
+                'known_tokens': {token_json},
+                'lock': threading.Lock(),
+                'local': threading.local(),
+                'etags': {},  # event id -> last seen ETag
+                'calendars': None,  # (fetched_at, calendarList entries), see list_calendars
+                'timer': None,  # proactive refresh (see _schedule_refresh)
+                'unsaved_token': None,  # (old tokens, new token) whose write failed, see _persist_token
+                'last_used': datetime.datetime.utcnow(),
+            }
+            _service_cache[key] = entry
+            _schedule_refresh(key, entry)
+    entry['last_used'] = datetime.datetime.utcnow()
+    return entry
+
+def invalidate_service(token_json=None):
+    """Drops cached credentials/services for a token (or for everyone if no token is given)."""
+    with _service_cache_lock:
+        if token_json is None:
+            entries = list(_service_cache.values())
+            _service_cache.clear()
+        else:
+            entry = _service_cache.pop(_user_key(json.loads(token_json)), None)
+            entries = [entry] if entry else []
+    for entry in entries:
+        if entry['timer']:
+            entry['timer'].cancel()
+
+def remember_etag(token_json, event):
+    """Caches the ETag of an event resource we just read or wrote."""
+    if event and event.get('id') and event.get('etag'):
+        _get_cache_entry(token_json)['etags'][event['id']] = event['etag']
+
+def cached_etag(token_json, event_id):
+    return _get_cache_entry(token_json)['etags'].get(event_id)
+
+def forget_etag(token_json, event_id):
+    _get_cache_entry(token_json)['etags'].pop(event_id, None)
+
+# --- Backend ---
+# Everything below talks to Google through a googleapiclient service object.
+# A fake backend (services/fake_calendar.py) can be swapped in to run offline:
+# it builds look-alike service objects (and an httpx transport for calendar_async).
+_backend = None
+
+def set_backend(backend):
+    """Routes all Calendar calls to `backend` (e.g. a FakeCalendar), or back to Google with None."""
+    global _backend
+    _backend = backend
+    invalidate_service()
+
+def get_backend():
+    return _backend
+
+def _build_service(creds):
+    if _backend is not None:
+        return _backend.service(creds)
+    doc = _get_discovery_doc()
+    if doc:
+        return build_from_document(doc, credentials=creds)
+    return build('calendar', 'v3', credentials=creds, cache_discovery=False)
+
+# --- Token Manager ---
+# Access tokens live for an hour. A timer refreshes each user's token shortly
+# before it expires, so request handlers normally never wait on a refresh.
+# Concurrent refreshes for the same user coalesce onto one request (the entry
+# lock), and every refreshed token is written back to the database.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Stop refreshing in the background for users who have gone quiet
+IDLE_LIMIT = datetime.timedelta(hours=12)
+
+def _expires_soon(creds):
+    return not creds.expiry or creds.expiry - datetime.datetime.utcnow() <= REFRESH_MARGIN
+
+def _persist_token(entry, old_tokens, new_token_json, db=None, user_id=None):
+    """Writes a refreshed token back to whichever user stored one of the old ones.
+    
+    With the caller's session (db, user_id) the write goes through it: a second session could not
+    get SQLite's write lock while the caller holds it. It is only flushed, so it commits (or rolls
+    back) with the caller's own work; until that commit it stays on the entry as unsaved. Otherwise
+    a session of our own is used. A write that fails (or is rolled back) is retried on the next use,
+    so the new token is not lost.
     """
-    creds_data = json.loads(token_json)
-    creds = Credentials.from_authorized_user_info(creds_data, SCOPES)
+    if db is not None and user_id:
+        import models
+        from sqlalchemy import event
+        entry['unsaved_token'] = (old_tokens, new_token_json)
+        user = db.get(models.User, user_id)
+        if user:
+            user.google_token = new_token_json
+            db.flush()
+
+        outcome = []
+
+        def saved(session):
+            if not outcome and entry.get('unsaved_token') == (old_tokens, new_token_json):
+                entry['unsaved_token'] = None
+            outcome.append('commit')
+
+        # Rolled back: the token stays unsaved and is written again on the next use
+        event.listen(db, "after_commit", saved, once=True)
+        event.listen(db, "after_rollback", lambda session: outcome.append('rollback'), once=True)
+        return
     
-    new_token_json = None
-    if creds and creds.expired and creds.refresh_token:
+    from database import SessionLocal
+    import models
+    own_db = SessionLocal()
+    try:
+        own_db.query(models.User).filter(models.User.google_token.in_(old_tokens)).update(
+            {models.User.google_token: new_token_json}, synchronize_session=False
+        )
+        own_db.commit()
+        entry['unsaved_token'] = None
+    except Exception as e:
+        own_db.rollback()
+        entry['unsaved_token'] = (old_tokens, new_token_json)
+        print(f"Failed to persist refreshed token, will retry on next use: {e}")
+    finally:
+        own_db.close()
+
+def _flush_unsaved_token(entry, db=None, user_id=None):
+    """Retries writing a refreshed token whose earlier write failed (see _persist_token)."""
+    unsaved = entry.get('unsaved_token')
+    if unsaved:
+        _persist_token(entry, unsaved[0], unsaved[1], db, user_id)
+
+def _refresh_entry(entry, db=None, user_id=None):
+    """Refreshes the entry's credentials once, however many threads ask at the same time.
+    
+    The new token is saved on the caller's session when one is given (see _persist_token).
+    Returns the new token JSON, or None if another caller already refreshed it.
+    """
+    with entry['lock']:
+        creds = entry['creds']
+        if not _expires_soon(creds):
+            return None # Someone else refreshed while we waited for the lock
+        if not creds.refresh_token:
+            raise Exception("Token is invalid. Please re-authenticate.")
         try:
             creds.refresh(Request())
-            # Token was refreshed, return new credentials to save
-            new_token_json = json.dumps(credentials_to_dict(creds))
         except Exception as e:
             print(f"Token refresh failed: {e}")
             raise Exception("Token has expired and could not be refreshed. Please re-authenticate.")
+        new_token_json = json.dumps(credentials_to_dict(creds))
+        old_tokens = list(entry['known_tokens'])
+        entry['known_tokens'].add(new_token_json)
+    
+    _persist_token(entry, old_tokens, new_token_json, db, user_id)
+    return new_token_json
+
+def _schedule_refresh(key, entry):
+    """Arms a timer that refreshes the entry REFRESH_MARGIN before its token expires."""
+    if entry['timer']:
+        entry['timer'].cancel()
+    if not entry['creds'].expiry or not entry['creds'].refresh_token:
+        return
+    delay = (entry['creds'].expiry - REFRESH_MARGIN - datetime.datetime.utcnow()).total_seconds()
+    timer = threading.Timer(max(delay, 0), _background_refresh, args=(key, entry))
+    timer.daemon = True
+    entry['timer'] = timer
+    timer.start()
+
+def _background_refresh(key, entry):
+    with _service_cache_lock:
+        if _service_cache.get(key) is not entry:
+            return # Replaced or invalidated since the timer was armed
+    if datetime.datetime.utcnow() - entry['last_used'] > IDLE_LIMIT:
+        entry['timer'] = None
+        return # Refresh lazily on next use instead
+    try:
+        _refresh_entry(entry)
+    except Exception as e:
+        print(f"Background token refresh failed: {e}")
+        return
+    _schedule_refresh(key, entry)
+
+def get_credentials(token_json, db=None, user_id=None):
+    """Returns the (cached) credentials for the stored token JSON.
+    
+    Returns: (credentials, new_token_json or None)
+    - If the token had to be refreshed on this call, returns the new token JSON
+      (it has already been saved to the database, on `db` when given)
+    - Otherwise returns None as second value
+    """
+    entry = _get_cache_entry(token_json)
+    _flush_unsaved_token(entry, db, user_id)
+    creds = entry['creds']
+    
+    new_token_json = None
+    if _expires_soon(creds):
+        if creds.valid and creds.expiry:
+            # Still usable: refresh off the hot path unless a refresh is already in flight
+            if not entry['lock'].locked():
+                threading.Thread(target=_background_refresh, args=(_user_key(json.loads(token_json)), entry), daemon=True).start()
+        else:
+            try:
+                new_token_json = _refresh_entry(entry, db, user_id)
+            except Exception:
+                invalidate_service(token_json)
+                raise
+            _schedule_refresh(_user_key(json.loads(token_json)), entry)
     elif not creds.valid:
+        invalidate_service(token_json)
         raise Exception("Token is invalid. Please re-authenticate.")
-        
-    service = build('calendar', 'v3', credentials=creds)
+    return creds, new_token_json
+
+def get_service(token_json, db=None, user_id=None):
+    """Returns the (cached) Google Calendar service for the stored token JSON.
+    
+    Returns: (service, new_token_json or None), see get_credentials.
+    """
+    creds, new_token_json = get_credentials(token_json, db, user_id)
+    
+    entry = _get_cache_entry(token_json)
+    service = getattr(entry['local'], 'service', None)
+    if service is None:
+        service = _build_service(creds)
+        entry['local'].service = service
     return service, new_token_json
 
-def list_events(token_json, time_min=None, time_max=None, db=None, user_id=None):
-    """Lists events from the primary calendar."""
-    service, new_token = get_service(token_json)
+def refresh_token(token_json, db=None, user_id=None):
+    """Refreshes the token now if it is about to expire, saving a new one on the caller's session.
+    
+    Called before handing work to calendar_async, whose requests run on another thread.
+    Returns the new token JSON, or None if the current one is still good.
+    """
+    _, new_token = get_credentials(token_json, db, user_id)
+    return new_token
+
+# --- Rate Limiting & Retries ---
+# Every API call goes through _execute: it waits on the user's token bucket,
+# then retries 429 / 403 rateLimitExceeded and 5xx responses with exponential
+# backoff. Limits and counters live in services/quota.py.
+
+def _error_reason(error):
+    """Extracts Google's error reason (e.g. 'rateLimitExceeded') from an HttpError."""
+    try:
+        errors = json.loads(error.content.decode('utf-8'))['error'].get('errors') or [{}]
+        return errors[0].get('reason')
+    except Exception:
+        return None
+
+def get_rate_limiter(token_json):
+    """Returns the user's token bucket (shared with calendar_async)."""
+    return quota.get_bucket(_user_key(json.loads(token_json)))
+
+def _throttle(bucket, cost=1):
+    wait = bucket.reserve(cost)
+    if wait > 0:
+        quota.record('throttled_seconds', wait)
+        time.sleep(wait)
+
+# Timeouts and dropped connections: the request may never have reached Google
+TRANSPORT_ERRORS = (socket.timeout, ConnectionError, httplib2.HttpLib2Error)
+
+def _execute(token_json, request, cost=1):
+    """Executes a googleapiclient request under the user's rate limit, retrying transient failures."""
+    bucket = get_rate_limiter(token_json)
+    for attempt in range(quota.MAX_RETRIES + 1):
+        _throttle(bucket, cost)
+        quota.record('requests', cost)
+        try:
+            return request.execute()
+        except HttpError as e:
+            kind = quota.classify(e.resp.status, _error_reason(e))
+            if kind is None or attempt == quota.MAX_RETRIES:
+                quota.record('failures')
+                raise
+            quota.record(kind)
+            quota.record('retries')
+            delay = quota.backoff_delay(attempt, e.resp.get('retry-after'))
+            if kind == 'rate_limited':
+                # Hold back every request for this user, not just this one
+                bucket.penalize(delay)
+            else:
+                time.sleep(delay)
+        except TRANSPORT_ERRORS:
+            if attempt == quota.MAX_RETRIES:
+                quota.record('failures')
+                raise
+            quota.record('network_errors')
+            quota.record('retries')
+            time.sleep(quota.backoff_delay(attempt))
+
+# Partial-response masks. The scheduler only needs times, titles and IDs (plus
+# ETags, which make later conditional updates possible); the mirror also keeps
+# status (to spot deletions) and description.
+SCHEDULER_FIELDS = 'items(id,etag,summary,start,end),nextPageToken'
+MIRROR_FIELDS = 'items(id,status,etag,summary,description,start,end),nextPageToken,nextSyncToken'
+
+# Max events per page (Google's upper limit is 2500)
+PAGE_SIZE = 250
+
+def iter_events(token_json, time_min=None, time_max=None, fields=None, db=None, user_id=None, calendar_id='primary'):
+    """Yields events from one calendar (the primary by default) in start order, page by page.
+    
+    `fields` is an optional partial-response mask (e.g. SCHEDULER_FIELDS); it must
+    include nextPageToken for pagination to work. Pages come from calendar_async,
+    and the next page is already in flight while the current one is consumed.
+    """
+    from services import calendar_async
     
     # If token was refreshed, save it
-    if new_token and db and user_id:
-        from crud import update_user_token
-        update_user_token(db, user_id, new_token)
+    token_json = refresh_token(token_json, db, user_id) or token_json
     
-    if not time_min:
-        time_min = datetime.datetime.utcnow().isoformat() + 'Z'
-        
-    events_result = service.events().list(
-        calendarId='primary', 
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
+    params = calendar_async.list_params(time_min, time_max, fields)
+    page = calendar_async.submit(calendar_async.list_events_page(token_json, params, calendar_id=calendar_id))
+    while page is not None:
+        events, page_token = page.result()
+        # Prefetch the next page before handing out this one
+        page = calendar_async.submit(calendar_async.list_events_page(token_json, params, page_token, calendar_id)) if page_token else None
+        yield from events
+
+def list_events(token_json, time_min=None, time_max=None, db=None, user_id=None, fields=None, calendar_id='primary'):
+    """Lists events from one calendar (all pages)."""
+    return list(iter_events(token_json, time_min=time_min, time_max=time_max, fields=fields, db=db, user_id=user_id, calendar_id=calendar_id))
+
+class SyncTokenExpired(Exception):
+    """Google invalidated the sync token (HTTP 410). A full sync is required."""
+
+def list_event_changes(token_json, sync_token=None, time_min=None, fields=MIRROR_FIELDS, db=None, user_id=None, calendar_id='primary', time_max=None):
+    """Lists events changed since `sync_token` (or every event between `time_min` and `time_max` on a full sync).
     
-    return events_result.get('items', [])
+    Follows pagination and returns (events, next_sync_token). Deleted events are
+    included with status 'cancelled' on incremental syncs. Raises SyncTokenExpired
+    when Google no longer accepts the sync token.
+    """
+    from services import calendar_async
+    
+    token_json = refresh_token(token_json, db, user_id) or token_json
+    return calendar_async.run_sync(calendar_async.list_event_changes(
+        token_json, sync_token=sync_token, time_min=time_min, fields=fields, calendar_id=calendar_id, time_max=time_max
+    ))
+
+# --- Calendar List ---
+# Shared course calendars, work calendars etc. count as busy time too. The list
+# itself rarely changes, so it is cached per user for CALENDAR_LIST_TTL.
+CALENDAR_LIST_TTL = datetime.timedelta(minutes=15)
+CALENDAR_LIST_FIELDS = 'items(id,summary,primary,selected,hidden,deleted,accessRole),nextPageToken'
+
+def list_calendars(token_json, refresh=False):
+    """Returns the user's calendarList entries (cached for CALENDAR_LIST_TTL unless refresh=True)."""
+    entry = _get_cache_entry(token_json)
+    cached = entry['calendars']
+    if cached and not refresh and datetime.datetime.utcnow() - cached[0] < CALENDAR_LIST_TTL:
+        return cached[1]
+    
+    service, _ = get_service(token_json)
+    calendars = []
+    page_token = None
+    while True:
+        result = _execute(token_json, service.calendarList().list(pageToken=page_token, fields=CALENDAR_LIST_FIELDS))
+        calendars.extend(result.get('items', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            break
+    entry['calendars'] = (datetime.datetime.utcnow(), calendars)
+    return calendars
+
+def selected_calendar_ids(token_json, fallback=True):
+    """IDs of the calendars whose events count as busy: 'primary' plus every other selected, visible calendar.
+    
+    If the calendar list cannot be loaded this returns just ['primary'], or raises with fallback=False
+    (for callers that act on the list itself, like pruning deselected calendars).
+    """
+    try:
+        calendars = list_calendars(token_json)
+    except Exception as e:
+        if not fallback:
+            raise
+        print(f"Failed to load calendar list, using the primary calendar only: {e}")
+        return ['primary']
+    
+    calendar_ids = ['primary']
+    for calendar in calendars:
+        if calendar.get('primary') or calendar.get('deleted') or calendar.get('hidden') or not calendar.get('selected'):
+            continue
+        calendar_ids.append(calendar['id'])
+    return calendar_ids
+
+# --- Free/Busy ---
+# Availability checks only need busy intervals. freebusy.query returns them
+# already merged, for many calendars in one request, without titles or
+# descriptions, and leaves out events marked as "free" (transparent).
+FREEBUSY_MAX_CALENDARS = 50  # Google's cap on items per query
+FREEBUSY_MAX_RANGE = datetime.timedelta(days=60)  # longer ranges are split into several queries
+
+def query_free_busy(token_json, time_min, time_max, calendar_ids=None, db=None, user_id=None):
+    """Returns the busy intervals of the calendars (default: every selected one) between two aware datetimes.
+    
+    The result is a sorted list of merged (start, end) pairs in time_min's timezone.
+    Raises if the primary calendar cannot be read; other unreadable calendars are skipped.
+    """
+    service, _ = get_service(token_json, db, user_id)
+    
+    if calendar_ids is None:
+        calendar_ids = selected_calendar_ids(token_json)
+    
+    tz = time_min.tzinfo
+    intervals = []
+    window_start = time_min
+    while window_start < time_max:
+        window_end = min(window_start + FREEBUSY_MAX_RANGE, time_max)
+        for chunk_start in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+            chunk = calendar_ids[chunk_start:chunk_start + FREEBUSY_MAX_CALENDARS]
+            body = {
+                'timeMin': window_start.isoformat(),
+                'timeMax': window_end.isoformat(),
+                'items': [{'id': calendar_id} for calendar_id in chunk],
+            }
+            result = _execute(token_json, service.freebusy().query(body=body))
+            for calendar_id, calendar in result.get('calendars', {}).items():
+                if calendar.get('errors'):
+                    if calendar_id == 'primary':
+                        raise Exception(f"FreeBusy failed for the primary calendar: {calendar['errors']}")
+                    print(f"FreeBusy skipped calendar {calendar_id}: {calendar['errors']}")
+                    continue
+                for busy in calendar.get('busy', []):
+                    intervals.append((parser.isoparse(busy['start']).astimezone(tz), parser.isoparse(busy['end']).astimezone(tz)))
+        window_start = window_end
+    
+    # Each calendar's list is merged already; merge across calendars (and range splits) too
+    intervals.sort()
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def new_event_id():
+    """A client-chosen event ID (base32hex-safe). Inserts always carry one, so a retried insert
+    that had already reached Google fails with 409 instead of creating a duplicate."""
+    return uuid.uuid4().hex
 
 def create_event(token_json, summary, start_time, end_time, description="", timezone="Europe/Istanbul"):
     """Creates an event in the primary calendar (or Ultron specific one)."""
     service, _ = get_service(token_json)
     
     event = {
+        'id': new_event_id(),
         'summary': summary,
         'description': description,
         'start': {
@@ -109,29 +547,156 @@ def create_event(token_json, summary, start_time, end_time, description="", time
         },
     }
     
-    event = service.events().insert(calendarId='primary', body=event).execute()
+    try:
+        event = _execute(token_json, service.events().insert(calendarId='primary', body=event))
+    except HttpError as e:
+        if e.resp.status != 409:
+            raise
+        # A retry of an attempt that did reach Google: return the event it created
+        event = _execute(token_json, service.events().get(calendarId='primary', eventId=event['id']))
+    remember_etag(token_json, event)
     return event
 
-def update_event(token_json, event_id, start_time, end_time, summary=None, timezone="Europe/Istanbul"):
-    """Updates an existing event."""
+def delete_event(token_json, event_id, db=None, user_id=None):
+    """Deletes an event from the primary calendar."""
+    from services import calendar_async
+    
+    token_json = refresh_token(token_json, db, user_id) or token_json
+    return calendar_async.run_sync(calendar_async.delete_event(token_json, event_id))
+
+# --- Push Notifications ---
+# Google caps event channels at about a week; we ask for that and renew early.
+WATCH_TTL_SECONDS = 7 * 24 * 3600
+
+def watch_events(token_json, channel_id, address, channel_token, ttl_seconds=WATCH_TTL_SECONDS):
+    """Opens a push-notification channel on the primary calendar.
+    
+    Google will POST to `address` (must be public HTTPS) whenever events change.
+    Returns the channel resource ('id', 'resourceId', 'expiration' in ms since epoch).
+    """
     service, _ = get_service(token_json)
+    body = {
+        'id': channel_id,
+        'type': 'web_hook',
+        'address': address,
+        'token': channel_token,
+        'params': {'ttl': str(ttl_seconds)},
+    }
+    return _execute(token_json, service.events().watch(calendarId='primary', body=body))
+
+def stop_channel(token_json, channel_id, resource_id):
+    """Stops a push-notification channel."""
+    service, _ = get_service(token_json)
+    _execute(token_json, service.channels().stop(body={'id': channel_id, 'resourceId': resource_id}))
+    return True
+
+# Google recommends keeping batch requests at or below 50 calls
+BATCH_SIZE = 50
+
+def event_time_fields(start_time, end_time, timezone):
+    return {
+        'start': {'dateTime': start_time.isoformat(), 'timeZone': timezone},
+        'end': {'dateTime': end_time.isoformat(), 'timeZone': timezone},
+    }
+
+def batch_mutate(token_json, operations, timezone="Europe/Istanbul", db=None, user_id=None):
+    """Applies many event mutations through Google batch HTTP requests (one round trip per BATCH_SIZE ops).
+    
+    Each operation is a dict:
+    - {'op': 'insert', 'summary', 'start_time', 'end_time', 'description' (optional),
+       'event_id' (optional: client-chosen ID; one is generated otherwise, so retries never duplicate)}
+    - {'op': 'update', 'event_id', 'start_time', 'end_time', 'summary' (optional)}
+      (sent as a PATCH, conditional on the cached ETag when we have one)
+    - {'op': 'delete', 'event_id'}
+    
+    Returns one result per operation, in the same order:
+    {'ok': True, 'event': <event resource or None for deletes>} or
+    {'ok': False, 'error': str, 'status': <HTTP status or None>}
+    
+    An insert whose event ID already exists (409, e.g. a retry of a request
+    that reached Google) counts as success.
+    """
+    service, _ = get_service(token_json, db, user_id)
     
-    # First retrieve the event to preserve other fields
-    event = service.events().get(calendarId='primary', eventId=event_id).execute()
+    results = [None] * len(operations)
+    retry_indices = []
+    # Every insert gets an event ID, so retrying one that already went through cannot duplicate it
+    insert_ids = {index: op.get('event_id') or new_event_id() for index, op in enumerate(operations) if op['op'] == 'insert'}
     
-    event['start']['dateTime'] = start_time.isoformat()
-    event['start']['timeZone'] = timezone
-    event['end']['dateTime'] = end_time.isoformat()
-    event['end']['timeZone'] = timezone
+    def on_response(request_id, response, exception):
+        index = int(request_id)
+        event_id = insert_ids.get(index) or operations[index].get('event_id')
+        if exception is not None:
+            status = exception.resp.status if isinstance(exception, HttpError) else None
+            if status is not None:
+                kind = quota.classify(status, _error_reason(exception))
+                if kind:
+                    # Rate-limited or transient: try this item again in the next round
+                    quota.record(kind)
+                    retry_indices.append(index)
+                elif status == 412:
+                    forget_etag(token_json, event_id)
+                elif status == 409 and operations[index]['op'] == 'insert':
+                    # Created by an earlier attempt that we never heard back from
+                    results[index] = {'ok': True, 'event': {'id': event_id}}
+                    return
+            results[index] = {'ok': False, 'error': str(exception), 'status': status}
+        else:
+            if operations[index]['op'] == 'delete':
+                forget_etag(token_json, event_id)
+            else:
+                remember_etag(token_json, response)
+            results[index] = {'ok': True, 'event': response or None}
     
-    if summary:
-        event['summary'] = summary
+    bucket = get_rate_limiter(token_json)
+    pending = list(range(len(operations)))
+    for attempt in range(quota.MAX_RETRIES + 1):
+        retry_indices.clear()
         
-    updated_event = service.events().update(calendarId='primary', eventId=event_id, body=event).execute()
-    return updated_event
+        for chunk_start in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[chunk_start:chunk_start + BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=on_response)
+            
+            for index in chunk:
+                op = operations[index]
+                if op['op'] == 'insert':
+                    body = {'summary': op['summary'], 'description': op.get('description', '')}
+                    body.update(event_time_fields(op['start_time'], op['end_time'], timezone))
+                    body['id'] = insert_ids[index]
+                    request = service.events().insert(calendarId='primary', body=body)
+                elif op['op'] == 'update':
+                    # Patch only the changed fields, so no read-modify-write round trip is needed
+                    body = event_time_fields(op['start_time'], op['end_time'], timezone)
+                    if op.get('summary'):
+                        body['summary'] = op['summary']
+                    request = service.events().patch(calendarId='primary', eventId=op['event_id'], body=body)
+                    etag = cached_etag(token_json, op['event_id'])
+                    if etag:
+                        request.headers['If-Match'] = etag
+                elif op['op'] == 'delete':
+                    request = service.events().delete(calendarId='primary', eventId=op['event_id'])
+                else:
+                    results[index] = {'ok': False, 'error': f"Unknown operation '{op['op']}'", 'status': None}
+                    continue
+                batch.add(request, request_id=str(index))
+            
+            # Every call inside a batch counts against the quota
+            _execute(token_json, batch, cost=len(chunk))
+        
+        if not retry_indices or attempt == quota.MAX_RETRIES:
+            break
+        
+        quota.record('retries', len(retry_indices))
+        pending = sorted(retry_indices)
+        bucket.penalize(quota.backoff_delay(attempt))
+    
+    quota.record('failures', len(retry_indices))
+    return results
 
-def delete_event(token_json, event_id):
-    """Deletes an event from the primary calendar."""
-    service, _ = get_service(token_json)
-    service.events().delete(calendarId='primary', eventId=event_id).execute()
-    return True
+def delete_events(token_json, event_ids, db=None, user_id=None):
+    """Deletes many events in batched requests. Returns the number of events deleted."""
+    results = batch_mutate(token_json, [{'op': 'delete', 'event_id': event_id} for event_id in event_ids], db=db, user_id=user_id)
+    for event_id, result in zip(event_ids, results):
+        if not result['ok']:
+            print(f"Failed to delete calendar event {event_id}: {result['error']}")
+    return sum(1 for result in results if result['ok'])
@@ -0,0 +1,347 @@
+import datetime
+import json
+import threading
+import uuid
+from sqlalchemy.orm import Session
+import models, crud
+from database import SessionLocal
+from services import calendar_integration, event_mirror
+
+# Write-behind queue for Google Calendar mutations.
+# Callers add outbox rows in the same transaction as their local change and
+# return right away; a background worker pushes the rows to Google in batches.
+# Rows are only marked done once Google has answered, so nothing is lost if the
+# process dies mid-sync. Inserts send the row's idempotency key as the event
+# ID, which makes re-sending them after a crash or timeout harmless, and lets a
+# block's event be deleted even when the insert's response never arrived.
+
+# Seconds between sweeps when nobody calls wake()
+POLL_INTERVAL = 30
+
+# Rows pushed per sweep (spread over as many batch requests as needed)
+DRAIN_LIMIT = 200
+
+# A row that keeps failing is given up on (and its block marked 'failed')
+MAX_ATTEMPTS = 8
+RETRY_BASE = datetime.timedelta(seconds=30)  # doubles every attempt
+RETRY_MAX = datetime.timedelta(hours=1)
+
+# Errors that retrying will not fix
+PERMANENT_STATUSES = {400, 403, 404, 410, 412}
+
+_wake = threading.Event()
+_stop = threading.Event()
+_worker = None
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def _local(dt):
+    """Block times come back from SQLite naive (local time); Google needs an offset."""
+    return dt.astimezone() if dt.tzinfo is None else dt
+
+def _pending_for_block(db: Session, block_id: int):
+    return db.query(models.CalendarOutbox).filter(
+        models.CalendarOutbox.study_block_id == block_id,
+        models.CalendarOutbox.status == "pending"
+    ).first()
+
+def enqueue_block_insert(db: Session, user_id: int, block: models.StudyBlock, summary: str, description: str = ""):
+    """Queues the Google event for a new study block (does not commit; the block must have an id)."""
+    entry = models.CalendarOutbox(
+        user_id=user_id,
+        study_block_id=block.id,
+        op="insert",
+        payload=json.dumps({'summary': summary, 'description': description}),
+        idempotency_key=uuid.uuid4().hex  # base32hex-safe, so Google accepts it as an event ID
+    )
+    db.add(entry)
+    block.sync_status = "pending"
+    return entry
+
+def enqueue_block_update(db: Session, user_id: int, block: models.StudyBlock):
+    """
+    Queues moving a study block's Google event to the block's current times (does not commit).
+    Coalesces with a row that is still waiting: that row reads the block's times when it is sent.
+    """
+    entry = _pending_for_block(db, block.id)
+    if entry:
+        return entry
+    entry = models.CalendarOutbox(
+        user_id=user_id,
+        study_block_id=block.id,
+        op="update",
+        payload="{}",
+        idempotency_key=uuid.uuid4().hex
+    )
+    db.add(entry)
+    block.sync_status = "pending"
+    return entry
+
+def enqueue_block_delete(db: Session, user_id: int, block: models.StudyBlock):
+    """
+    Queues deleting a study block's Google event, for a block about to be deleted (does not commit).
+    The event is addressed by its ID, which for blocks whose insert was sent but not (yet) answered
+    is the insert's idempotency key. Waiting rows for the block are cancelled; an insert that never
+    left needs no delete. Returns the row, or None if the block never reached Google.
+    """
+    event_id = block.google_event_id
+    for entry in db.query(models.CalendarOutbox).filter(
+        models.CalendarOutbox.study_block_id == block.id
+    ).order_by(models.CalendarOutbox.id).all():
+        if entry.status == "pending":
+            entry.status = "cancelled"
+        if entry.op == "insert" and not event_id and (entry.status != "cancelled" or entry.attempts):
+            # Sent at least once (in flight, done, failed or retrying): the event may exist
+            event_id = entry.idempotency_key
+    if not event_id:
+        return None
+    return _enqueue_event_delete(db, user_id, event_id)
+
+def enqueue_task_delete(db: Session, user_id: int, task: models.Task):
+    """Queues deleting the Google events of all of a task's study blocks (does not commit). Returns the number queued."""
+    return sum(1 for block in task.study_blocks if enqueue_block_delete(db, user_id, block))
+
+def _enqueue_event_delete(db: Session, user_id: int, event_id: str):
+    entry = models.CalendarOutbox(
+        user_id=user_id,
+        study_block_id=None,  # the block is gone by the time this is sent
+        op="delete",
+        payload=json.dumps({'event_id': event_id}),
+        idempotency_key=uuid.uuid4().hex
+    )
+    db.add(entry)
+    return entry
+
+def requeue_block(db: Session, block: models.StudyBlock):
+    """Gives a block whose sync failed another round of attempts. Returns the row, or None if there is nothing to retry."""
+    entry = db.query(models.CalendarOutbox).filter(
+        models.CalendarOutbox.study_block_id == block.id
+    ).order_by(models.CalendarOutbox.id.desc()).first()
+    if not entry or entry.status != "failed":
+        return None
+    entry.status = "pending"
+    entry.attempts = 0
+    entry.next_attempt_at = _utcnow()
+    block.sync_status = "pending"
+    db.commit()
+    wake()
+    return entry
+
+def queued_insert_ids(db: Session, user_id: int, block_ids=None):
+    """
+    Google event IDs of inserts not yet confirmed (queued or in flight), optionally only those
+    for `block_ids`. Their events may already be on Google before the block learns its google_event_id.
+    """
+    query = db.query(models.CalendarOutbox.idempotency_key).filter(
+        models.CalendarOutbox.user_id == user_id,
+        models.CalendarOutbox.op == "insert",
+        models.CalendarOutbox.status.in_(("pending", "sending"))
+    )
+    if block_ids is not None:
+        query = query.filter(models.CalendarOutbox.study_block_id.in_(block_ids))
+    return {event_id for (event_id,) in query}
+
+def block_sync_status(db: Session, blocks):
+    """Returns the Google sync state of each block, with the latest outbox attempt's details."""
+    block_ids = [block.id for block in blocks]
+    latest = {}
+    if block_ids:
+        entries = db.query(models.CalendarOutbox).filter(
+            models.CalendarOutbox.study_block_id.in_(block_ids)
+        ).order_by(models.CalendarOutbox.id).all()
+        for entry in entries:
+            latest[entry.study_block_id] = entry
+
+    statuses = []
+    for block in blocks:
+        entry = latest.get(block.id)
+        statuses.append({
+            "block_id": block.id,
+            "start_time": block.start_time,
+            "end_time": block.end_time,
+            "sync_status": block.sync_status,
+            "google_event_id": block.google_event_id,
+            "attempts": entry.attempts if entry else 0,
+            "last_error": entry.last_error if entry else None,
+            "next_attempt_at": entry.next_attempt_at if entry and entry.status == "pending" else None,
+        })
+    return statuses
+
+def _build_operation(db: Session, user: models.User, entry: models.CalendarOutbox):
+    """Turns an outbox row into a calendar_integration.batch_mutate operation, or None if it is moot."""
+    if entry.op == "delete":
+        return {'op': 'delete', 'event_id': json.loads(entry.payload)['event_id']}
+
+    block = db.get(models.StudyBlock, entry.study_block_id) if entry.study_block_id else None
+    # The task (and with it the block) was deleted before we got to it
+    if not block or block.task_id is None:
+        return None
+
+    if entry.op == "insert":
+        payload = json.loads(entry.payload)
+        return {
+            'op': 'insert',
+            'event_id': entry.idempotency_key,
+            'summary': payload['summary'],
+            'description': payload.get('description', ''),
+            'start_time': _local(block.start_time),
+            'end_time': _local(block.end_time),
+        }
+    if entry.op == "update":
+        if not block.google_event_id:
+            return None
+        # After a restart the ETag cache is cold; the mirror still knows the last ETag
+        if not calendar_integration.cached_etag(user.google_token, block.google_event_id):
+            calendar_integration.remember_etag(user.google_token, event_mirror.get_cached_event(db, user.id, block.google_event_id))
+        return {
+            'op': 'update',
+            'event_id': block.google_event_id,
+            'start_time': _local(block.start_time),
+            'end_time': _local(block.end_time),
+        }
+    return None
+
+def _apply_result(db: Session, entry: models.CalendarOutbox, result: dict):
+    block = db.get(models.StudyBlock, entry.study_block_id) if entry.study_block_id else None
+    entry.attempts = (entry.attempts or 0) + 1
+
+    # Deleting an event that is already gone (or was never created) is a success
+    if entry.op == "delete" and not result['ok'] and result.get('status') in (404, 410):
+        result = {'ok': True, 'event': None}
+
+    if result['ok']:
+        entry.status = "done"
+        entry.last_error = None
+        if entry.op == "insert" and (not block or block.task_id is None):
+            # The task was deleted while the insert was in flight: take the new event down again
+            # (unless the delete that removed the block already addresses it)
+            event_id = (result['event'] or {}).get('id') or entry.idempotency_key
+            if not db.query(models.CalendarOutbox.id).filter(
+                models.CalendarOutbox.op == "delete",
+                models.CalendarOutbox.payload == json.dumps({'event_id': event_id})
+            ).first():
+                _enqueue_event_delete(db, entry.user_id, event_id)
+                wake()
+            return
+        if block:
+            if entry.op == "insert":
+                block.google_event_id = (result['event'] or {}).get('id') or entry.idempotency_key
+            # A change queued while this one was in flight is still to come
+            if not _pending_for_block(db, block.id):
+                block.sync_status = "synced"
+        return
+
+    entry.last_error = result['error']
+    if result.get('status') in PERMANENT_STATUSES or entry.attempts >= MAX_ATTEMPTS:
+        entry.status = "failed"
+        if block:
+            block.sync_status = "failed"
+        return
+
+    entry.status = "pending"
+    entry.next_attempt_at = _utcnow() + min(RETRY_MAX, RETRY_BASE * (2 ** (entry.attempts - 1)))
+
+def drain(db: Session, limit: int = DRAIN_LIMIT):
+    """Pushes due outbox rows to Google, one batch_mutate call per user. Returns the number of rows handled."""
+    entries = db.query(models.CalendarOutbox).filter(
+        models.CalendarOutbox.status == "pending",
+        models.CalendarOutbox.next_attempt_at <= _utcnow()
+    ).order_by(models.CalendarOutbox.id).limit(limit).all()
+    if not entries:
+        return 0
+
+    # Claim the rows first: an update queued while they are in flight must get a row of its own
+    for entry in entries:
+        entry.status = "sending"
+    db.commit()
+
+    by_user = {}
+    for entry in entries:
+        by_user.setdefault(entry.user_id, []).append(entry)
+
+    for user_id, user_entries in by_user.items():
+        user = crud.get_user(db, user_id)
+        if not user or not user.google_token:
+            # Not connected (any more); pick the rows up again once the user reconnects
+            for entry in user_entries:
+                entry.status = "pending"
+                entry.next_attempt_at = _utcnow() + RETRY_MAX
+            db.commit()
+            continue
+
+        operations, sent = [], []
+        try:
+            for entry in user_entries:
+                operation = _build_operation(db, user, entry)
+                if operation is None:
+                    entry.status = "cancelled"
+                    continue
+                operations.append(operation)
+                sent.append(entry)
+            results = calendar_integration.batch_mutate(user.google_token, operations, db=db, user_id=user.id) if operations else []
+        except Exception as e:
+            # e.g. a revoked token; every row of this user is retried later
+            sent = [entry for entry in user_entries if entry.status == "sending"]
+            results = [{'ok': False, 'error': str(e), 'status': None}] * len(sent)
+        for entry, result in zip(sent, results):
+            _apply_result(db, entry, result)
+        db.commit()
+
+        if sent:
+            event_mirror.mark_stale(db, user.id)
+            db.commit()
+
+    return len(entries)
+
+def recover(db: Session):
+    """Returns rows left 'sending' by a crashed worker to the queue (re-sending them is idempotent)."""
+    count = db.query(models.CalendarOutbox).filter(
+        models.CalendarOutbox.status == "sending"
+    ).update({models.CalendarOutbox.status: "pending"})
+    db.commit()
+    return count
+
+# --- Background worker ---
+
+def wake():
+    """Asks the worker to sweep now instead of at the next poll."""
+    _wake.set()
+
+def _run():
+    while not _stop.is_set():
+        _wake.clear()
+        db = SessionLocal()
+        try:
+            while drain(db) == DRAIN_LIMIT:
+                pass
+        except Exception as e:
+            print(f"Calendar outbox sweep failed: {e}")
+        finally:
+            db.close()
+        _wake.wait(POLL_INTERVAL)
+
+def start_worker():
+    """Starts the background worker (once per process)."""
+    global _worker
+    if _worker and _worker.is_alive():
+        return _worker
+    db = SessionLocal()
+    try:
+        recovered = recover(db)
+        if recovered:
+            print(f"Re-queued {recovered} calendar changes interrupted by a restart")
+    finally:
+        db.close()
+    _stop.clear()
+    _worker = threading.Thread(target=_run, name="calendar-outbox", daemon=True)
+    _worker.start()
+    return _worker
+
+def stop_worker(timeout: float = 10):
+    """Stops the worker after its current sweep; unsent rows stay queued for the next start."""
+    _stop.set()
+    _wake.set()
+    if _worker:
+        _worker.join(timeout)
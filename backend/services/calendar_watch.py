@@ -0,0 +1,218 @@
+import datetime
+import hmac
+import os
+import secrets
+import threading
+import uuid
+from sqlalchemy.orm import Session
+import models, crud
+from database import SessionLocal
+from services import calendar_integration, event_mirror
+
+# Public HTTPS URL that Google should POST change notifications to.
+# It must route to /webhooks/google/calendar. Push is disabled when unset.
+WEBHOOK_URL = os.environ.get("GOOGLE_WEBHOOK_URL")
+
+# Renew a channel once it is this close to expiring
+RENEW_BEFORE = datetime.timedelta(days=1)
+
+# Seconds between the background worker's renewal sweeps (well inside RENEW_BEFORE)
+RENEW_INTERVAL = 3600
+
+_stop = threading.Event()
+_worker = None
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def active_channel(db: Session, user_id: int):
+    """Returns the user's newest unexpired channel, or None."""
+    return db.query(models.CalendarWatchChannel).filter(
+        models.CalendarWatchChannel.user_id == user_id,
+        models.CalendarWatchChannel.expiration > _utcnow()
+    ).order_by(models.CalendarWatchChannel.expiration.desc()).first()
+
+def start_watch(db: Session, user: models.User, address: str = None, notifier=calendar_integration):
+    """
+    Opens a new channel for the user and stops any channel it replaces.
+    `notifier` provides watch_events/stop_channel (Google by default, LocalNotifier in tests).
+    """
+    address = address or WEBHOOK_URL
+    if not address:
+        raise ValueError("GOOGLE_WEBHOOK_URL is not configured.")
+
+    channel_id = str(uuid.uuid4())
+    channel_token = secrets.token_urlsafe(32)
+    resource = notifier.watch_events(user.google_token, channel_id, address, channel_token)
+
+    old_channels = db.query(models.CalendarWatchChannel).filter(models.CalendarWatchChannel.user_id == user.id).all()
+
+    channel = models.CalendarWatchChannel(
+        user_id=user.id,
+        channel_id=channel_id,
+        resource_id=resource.get('resourceId'),
+        token=channel_token,
+        expiration=datetime.datetime.fromtimestamp(int(resource['expiration']) / 1000, datetime.timezone.utc).replace(tzinfo=None)
+    )
+    db.add(channel)
+
+    for old in old_channels:
+        try:
+            notifier.stop_channel(user.google_token, old.channel_id, old.resource_id)
+        except Exception as e:
+            # An already-expired channel cannot be stopped; it just goes away
+            print(f"Failed to stop watch channel {old.channel_id}: {e}")
+        db.delete(old)
+
+    db.commit()
+    return channel
+
+def ensure_watch(db: Session, user: models.User, notifier=calendar_integration):
+    """Starts or renews the user's channel if push is configured. Returns the active channel or None."""
+    if not WEBHOOK_URL or not user.google_token:
+        return None
+    channel = active_channel(db, user.id)
+    if channel and channel.expiration - _utcnow() > RENEW_BEFORE:
+        return channel
+    return start_watch(db, user, notifier=notifier)
+
+def renew_expiring(db: Session, notifier=calendar_integration):
+    """
+    Renews every channel that expires within RENEW_BEFORE (or already has, e.g. after downtime),
+    so push keeps covering the mirror without waiting for a request. Returns the number renewed.
+    """
+    if not WEBHOOK_URL:
+        return 0
+    user_ids = [user_id for (user_id,) in db.query(models.CalendarWatchChannel.user_id).filter(
+        models.CalendarWatchChannel.expiration <= _utcnow() + RENEW_BEFORE
+    ).distinct().all()]
+
+    renewed = 0
+    for user_id in user_ids:
+        user = crud.get_user(db, user_id)
+        if not user or not user.google_token:
+            continue
+        channel = active_channel(db, user_id)
+        if channel and channel.expiration - _utcnow() > RENEW_BEFORE:
+            continue  # only an old channel is expiring; the newest one is still good
+        try:
+            start_watch(db, user, notifier=notifier)
+            renewed += 1
+        except Exception as e:
+            # The mirror falls back to MAX_STALENESS once the channel has expired
+            db.rollback()
+            print(f"Failed to renew watch channel for user {user_id}: {e}")
+    return renewed
+
+def stop_watch(db: Session, user: models.User, notifier=calendar_integration):
+    """Stops all of the user's channels. Returns how many were removed."""
+    channels = db.query(models.CalendarWatchChannel).filter(models.CalendarWatchChannel.user_id == user.id).all()
+    for channel in channels:
+        try:
+            notifier.stop_channel(user.google_token, channel.channel_id, channel.resource_id)
+        except Exception as e:
+            print(f"Failed to stop watch channel {channel.channel_id}: {e}")
+        db.delete(channel)
+    db.commit()
+    return len(channels)
+
+def handle_notification(db: Session, channel_id: str, channel_token: str, resource_state: str, message_number=None):
+    """
+    Processes one push notification (the X-Goog-* headers of Google's POST).
+    Invalidates the user's cached calendar data and returns their user_id,
+    or None if there is nothing to do (unknown channel, handshake, duplicate).
+    Raises PermissionError if the channel token does not match.
+    """
+    channel = db.query(models.CalendarWatchChannel).filter(models.CalendarWatchChannel.channel_id == channel_id).first()
+    if not channel:
+        return None
+    if not hmac.compare_digest(channel.token or "", channel_token or ""):
+        raise PermissionError("Invalid channel token")
+
+    # 'sync' is the handshake Google sends when the channel is created
+    if resource_state == "sync":
+        return None
+
+    if message_number is not None:
+        message_number = int(message_number)
+        if message_number <= (channel.last_message_number or 0):
+            return None
+        channel.last_message_number = message_number
+
+    event_mirror.mark_stale(db, channel.user_id)
+    db.commit()
+    return channel.user_id
+
+def refresh_user(user_id: int):
+    """Pulls the changes behind a notification into the mirror (runs as a background task with its own session)."""
+    db = SessionLocal()
+    try:
+        user = crud.get_user(db, user_id)
+        if user and user.google_token:
+            event_mirror.sync(db, user)
+            ensure_watch(db, user)
+    except Exception as e:
+        print(f"Calendar refresh after notification failed: {e}")
+    finally:
+        db.close()
+
+# --- Background worker ---
+
+def _run():
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            renew_expiring(db)
+        except Exception as e:
+            print(f"Watch channel renewal sweep failed: {e}")
+        finally:
+            db.close()
+        _stop.wait(RENEW_INTERVAL)
+
+def start_worker():
+    """Starts the channel renewal worker (once per process; a no-op while push is not configured)."""
+    global _worker
+    if not WEBHOOK_URL or (_worker and _worker.is_alive()):
+        return _worker
+    _stop.clear()
+    _worker = threading.Thread(target=_run, name="calendar-watch", daemon=True)
+    _worker.start()
+    return _worker
+
+def stop_worker(timeout: float = 10):
+    """Stops the renewal worker after its current sweep."""
+    _stop.set()
+    if _worker:
+        _worker.join(timeout)
+
+
+class LocalNotifier:
+    """
+    In-process stand-in for Google's push service, for tests and offline runs.
+    Pass it as `notifier` to start_watch/ensure_watch/stop_watch, then call
+    notify() to deliver a change notification exactly like Google's webhook would.
+    """
+
+    def __init__(self, ttl=datetime.timedelta(days=7)):
+        self.ttl = ttl
+        self.channels = {}  # channel_id -> {'token', 'address', 'resource_id', 'messages'}
+
+    def watch_events(self, token_json, channel_id, address, channel_token, ttl_seconds=None):
+        resource_id = f"local-{uuid.uuid4().hex[:12]}"
+        self.channels[channel_id] = {'token': channel_token, 'address': address, 'resource_id': resource_id, 'messages': 1}
+        expiration = datetime.datetime.now(datetime.timezone.utc) + self.ttl
+        return {'id': channel_id, 'resourceId': resource_id, 'expiration': str(int(expiration.timestamp() * 1000))}
+
+    def stop_channel(self, token_json, channel_id, resource_id):
+        self.channels.pop(channel_id, None)
+        return True
+
+    def notify(self, db: Session, user_id: int, resource_state: str = "exists"):
+        """Delivers a notification on the user's active channel. Returns handle_notification's result."""
+        channel = active_channel(db, user_id)
+        if not channel or channel.channel_id not in self.channels:
+            return None
+        local = self.channels[channel.channel_id]
+        local['messages'] += 1
+        return handle_notification(db, channel.channel_id, local['token'], resource_state, local['messages'])
@@ -0,0 +1,350 @@
+import asyncio
+import datetime
+import heapq
+import json
+from sqlalchemy.orm import Session
+from dateutil import parser
+import models
+from services import calendar_integration, calendar_async, gap_cache
+
+# The mirror covers every selected calendar in the user's calendar list (see
+# calendar_integration.selected_calendar_ids), each with its own sync token.
+
+# How old the mirror may get before a read triggers an incremental sync.
+# Incremental syncs only transfer what changed, so this can stay short.
+MAX_STALENESS = datetime.timedelta(minutes=5)
+
+# With an active push channel (see calendar_watch) every change to the primary
+# calendar invalidates it, so the time-based bound is only a safety net for
+# lost notifications. Other calendars are not watched and use MAX_STALENESS,
+# as does the primary once its channel has expired (calendar_watch renews
+# channels in the background before that happens).
+WATCHED_MAX_STALENESS = datetime.timedelta(hours=6)
+
+# How far back the initial full sync reaches. Older ranges are fetched live.
+HISTORY_WINDOW = datetime.timedelta(days=30)
+
+# How far ahead it reaches. Later ranges are fetched live too. Once less than
+# half of it is left, the next sync is a full one that moves the window forward.
+FUTURE_WINDOW = datetime.timedelta(days=180)
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def _to_utc_naive(dt):
+    """Converts an aware datetime (or ISO string) to naive UTC. Naive input is treated as local time."""
+    if isinstance(dt, str):
+        dt = parser.isoparse(dt)
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def _event_bounds(event):
+    """Returns (start, end, is_all_day) for a Google event resource, in naive UTC."""
+    if 'dateTime' in event['start']:
+        return _to_utc_naive(event['start']['dateTime']), _to_utc_naive(event['end']['dateTime']), False
+    start = datetime.datetime.strptime(event['start']['date'], "%Y-%m-%d")
+    end = datetime.datetime.strptime(event['end']['date'], "%Y-%m-%d")
+    return start, end, True
+
+def _is_watched(db: Session, user_id: int):
+    return db.query(models.CalendarWatchChannel.id).filter(
+        models.CalendarWatchChannel.user_id == user_id,
+        models.CalendarWatchChannel.expiration > _utcnow()
+    ).first() is not None
+
+def _start_key(event, tz=None):
+    """Sort key for merging event streams: the start as a timestamp (all-day events start at midnight in tz)."""
+    if 'dateTime' in event['start']:
+        return parser.isoparse(event['start']['dateTime']).timestamp()
+    day = datetime.datetime.strptime(event['start']['date'], "%Y-%m-%d")
+    return (day.replace(tzinfo=tz) if tz else day.astimezone()).timestamp()
+
+def _get_state(db: Session, user_id: int, calendar_id: str = 'primary'):
+    state = db.query(models.CalendarSyncState).filter(
+        models.CalendarSyncState.user_id == user_id,
+        models.CalendarSyncState.calendar_id == calendar_id
+    ).first()
+    if not state:
+        state = models.CalendarSyncState(user_id=user_id, calendar_id=calendar_id)
+        db.add(state)
+        db.flush()
+    return state
+
+def _calendar_ids(db: Session, user: models.User):
+    """
+    Returns (calendar_ids, listed): the user's selected calendars, and whether the calendar list was
+    actually loaded. If it could not be, the calendars already in the mirror are used instead (so their
+    events still count as busy) and listed is False: nothing may be pruned on that guess.
+    """
+    try:
+        return calendar_integration.selected_calendar_ids(user.google_token, fallback=False), True
+    except Exception as e:
+        print(f"Failed to load calendar list, using the mirrored calendars: {e}")
+    known = [row.calendar_id for row in db.query(models.CalendarSyncState.calendar_id).filter(
+        models.CalendarSyncState.user_id == user.id
+    ).all()]
+    return ['primary'] + [calendar_id for calendar_id in known if calendar_id != 'primary'], False
+
+def _drop_unselected(db: Session, user_id: int, calendar_ids):
+    """Forgets calendars the user removed or deselected (does not commit). Only call with a freshly loaded calendar list."""
+    dropped = db.query(models.CalendarEvent).filter(
+        models.CalendarEvent.user_id == user_id,
+        models.CalendarEvent.calendar_id.notin_(calendar_ids)
+    ).delete(synchronize_session=False)
+    if dropped:
+        gap_cache.bump(user_id)
+    db.query(models.CalendarSyncState).filter(
+        models.CalendarSyncState.user_id == user_id,
+        models.CalendarSyncState.calendar_id.notin_(calendar_ids)
+    ).delete(synchronize_session=False)
+
+def upsert_event(db: Session, user_id: int, event: dict, calendar_id: str = 'primary'):
+    """Inserts or replaces one event in the mirror (does not commit)."""
+    row = db.query(models.CalendarEvent).filter(
+        models.CalendarEvent.user_id == user_id,
+        models.CalendarEvent.calendar_id == calendar_id,
+        models.CalendarEvent.google_event_id == event['id']
+    ).first()
+
+    if event.get('status') == 'cancelled':
+        if row:
+            db.delete(row)
+        return
+
+    start, end, is_all_day = _event_bounds(event)
+    if not row:
+        row = models.CalendarEvent(user_id=user_id, calendar_id=calendar_id, google_event_id=event['id'])
+        db.add(row)
+    row.summary = event.get('summary')
+    row.start_time = start
+    row.end_time = end
+    row.is_all_day = is_all_day
+    row.raw = json.dumps(event)
+
+def get_cached_event(db: Session, user_id: int, event_id: str, calendar_id: str = 'primary'):
+    """Returns the mirrored event resource for an ID (no sync), or None."""
+    row = db.query(models.CalendarEvent).filter(
+        models.CalendarEvent.user_id == user_id,
+        models.CalendarEvent.calendar_id == calendar_id,
+        models.CalendarEvent.google_event_id == event_id
+    ).first()
+    return json.loads(row.raw) if row else None
+
+def mark_stale(db: Session, user_id: int, calendar_id: str = 'primary'):
+    """
+    Forces the next read to pull changes for the calendar from Google (call after mutating it).
+    Only flushes: committing is up to the caller, as part of its own transaction.
+    """
+    state = db.query(models.CalendarSyncState).filter(
+        models.CalendarSyncState.user_id == user_id,
+        models.CalendarSyncState.calendar_id == calendar_id
+    ).first()
+    if state:
+        state.last_synced_at = None
+        db.flush()
+    gap_cache.bump(user_id)
+
+def clear(db: Session, user_id: int):
+    """Drops the user's mirror entirely, e.g. after reconnecting a different Google account."""
+    db.query(models.CalendarEvent).filter(models.CalendarEvent.user_id == user_id).delete()
+    db.query(models.CalendarSyncState).filter(models.CalendarSyncState.user_id == user_id).delete()
+    db.commit()
+    gap_cache.bump(user_id)
+
+async def _fetch_changes(token_json, calendar_id, sync_token, window_start, window_end):
+    """Returns (changes, next_sync_token, is_full_sync) for one calendar."""
+    if sync_token:
+        try:
+            changes, next_token = await calendar_async.list_event_changes(token_json, sync_token=sync_token, calendar_id=calendar_id)
+            return changes, next_token, False
+        except calendar_integration.SyncTokenExpired:
+            print(f"Calendar sync token expired for {calendar_id}, running full sync")
+    changes, next_token = await calendar_async.list_event_changes(
+        token_json, time_min=window_start.isoformat() + 'Z', time_max=window_end.isoformat() + 'Z', calendar_id=calendar_id
+    )
+    return changes, next_token, True
+
+async def _fetch_all_changes(token_json, jobs):
+    return await asyncio.gather(*[_fetch_changes(token_json, *job) for job in jobs], return_exceptions=True)
+
+def sync(db: Session, user: models.User, calendar_ids=None):
+    """
+    Brings the mirror up to date for the given calendars (default: every selected one).
+    All calendars are fetched concurrently. Each uses its stored syncToken to
+    fetch only changes, and falls back to a full sync (from now - HISTORY_WINDOW
+    to now + FUTURE_WINDOW) when there is no token, Google expired it, or the
+    mirrored window is running out.
+    Returns the number of changes applied. Raises only if every calendar failed.
+    """
+    if calendar_ids is None:
+        calendar_ids, listed = _calendar_ids(db, user)
+        if listed:
+            _drop_unselected(db, user.id, calendar_ids)
+    applied, error = _apply_changes(db, user, calendar_ids)
+    db.commit()
+    if error:
+        raise error
+    return applied
+
+def _apply_changes(db: Session, user: models.User, calendar_ids):
+    """
+    Fetches and applies the changes for the given calendars (does not commit; see sync).
+    Returns (changes applied, the first error if every calendar failed, else None).
+    """
+    states = [_get_state(db, user.id, calendar_id) for calendar_id in calendar_ids]
+    now = _utcnow()
+    window_start = now - HISTORY_WINDOW
+    window_end = now + FUTURE_WINDOW
+
+    def usable_token(state):
+        # A window that is missing (mirrored before it was bounded) or half used up needs a full sync
+        if not state.window_end or state.window_end - now < FUTURE_WINDOW / 2:
+            return None
+        return state.sync_token
+
+    calendar_integration.refresh_token(user.google_token, db, user.id)
+    results = calendar_async.run_sync(_fetch_all_changes(
+        user.google_token, [(state.calendar_id, usable_token(state), window_start, window_end) for state in states]
+    ))
+
+    applied = 0
+    errors = []
+    for state, result in zip(states, results):
+        if isinstance(result, Exception):
+            print(f"Calendar sync failed for {state.calendar_id}: {result}")
+            errors.append(result)
+            continue
+
+        changes, next_token, full_sync = result
+        if full_sync:
+            db.query(models.CalendarEvent).filter(
+                models.CalendarEvent.user_id == user.id,
+                models.CalendarEvent.calendar_id == state.calendar_id
+            ).delete()
+            state.window_start = window_start
+            state.window_end = window_end
+            gap_cache.bump(user.id)
+        for event in changes:
+            upsert_event(db, user.id, event, state.calendar_id)
+
+        state.sync_token = next_token
+        state.last_synced_at = _utcnow()
+        applied += len(changes)
+
+    db.flush()
+    return applied, errors[0] if errors and len(errors) == len(states) else None
+
+def iter_live_events(token_json, time_min, time_max, fields=None, calendar_ids=None):
+    """
+    Fetches the range straight from Google, from every selected calendar concurrently,
+    and yields the events merged into one stream in start order (k-way merge).
+    time_min/time_max are aware datetimes. A failing secondary calendar is skipped.
+    """
+    if calendar_ids is None:
+        calendar_ids = calendar_integration.selected_calendar_ids(token_json)
+
+    results = calendar_async.run_sync(calendar_async.list_events_for_calendars(
+        token_json, calendar_ids, time_min=time_min.isoformat(), time_max=time_max.isoformat(), fields=fields
+    ))
+
+    streams = []
+    for calendar_id, result in zip(calendar_ids, results):
+        if isinstance(result, Exception):
+            if calendar_id == 'primary':
+                raise result
+            print(f"Failed to fetch calendar {calendar_id}: {result}")
+            continue
+        streams.append(result)
+
+    tz = time_min.tzinfo
+    yield from heapq.merge(*streams, key=lambda event: _start_key(event, tz))
+
+def iter_events(db: Session, user: models.User, time_min, time_max, max_staleness=None, force_refresh=False, fields=None):
+    """
+    Yields Google event resources from all selected calendars overlapping
+    [time_min, time_max), roughly in start order.
+    time_min/time_max may be aware datetimes or ISO strings.
+
+    Calendars older than `max_staleness` (default: MAX_STALENESS, or
+    WATCHED_MAX_STALENESS for the primary calendar while a push channel is
+    active) are synced first, or all of them with force_refresh=True. Ranges
+    older than the mirrored window are fetched live, using the optional `fields` mask.
+    """
+    if not user.google_token:
+        return
+
+    if isinstance(time_min, str):
+        time_min = parser.isoparse(time_min)
+    if isinstance(time_max, str):
+        time_max = parser.isoparse(time_max)
+    if time_min.tzinfo is None:
+        time_min = time_min.astimezone()
+    if time_max.tzinfo is None:
+        time_max = time_max.astimezone()
+
+    calendar_ids, listed = _calendar_ids(db, user)
+    watched = _is_watched(db, user.id)
+
+    now = _utcnow()
+    stale = []
+    for calendar_id in calendar_ids:
+        state = _get_state(db, user.id, calendar_id)
+        limit = max_staleness
+        if limit is None:
+            limit = WATCHED_MAX_STALENESS if watched and calendar_id == 'primary' else MAX_STALENESS
+        if force_refresh or not state.last_synced_at or now - state.last_synced_at > limit:
+            stale.append(state)
+
+    if stale:
+        never_synced = all(not state.last_synced_at and not state.sync_token for state in stale)
+        try:
+            # A savepoint, so a failed sync does not take the caller's pending changes with it
+            with db.begin_nested():
+                if listed:
+                    _drop_unselected(db, user.id, calendar_ids)
+                _, error = _apply_changes(db, user, [state.calendar_id for state in stale])
+                if error:
+                    raise error
+        except Exception as e:
+            if never_synced:
+                raise
+            # Serve the (slightly stale) mirror rather than failing the read
+            print(f"Calendar mirror sync failed, serving cached events: {e}")
+        else:
+            db.commit()
+
+    min_utc = _to_utc_naive(time_min)
+    max_utc = _to_utc_naive(time_max)
+
+    # Ranges outside the mirrored window (of any calendar) are fetched live
+    states = [_get_state(db, user.id, calendar_id) for calendar_id in calendar_ids]
+    window_starts = [state.window_start for state in states if state.window_start]
+    window_ends = [state.window_end for state in states if state.window_end]
+    if (window_starts and min_utc < max(window_starts)) or (window_ends and max_utc > min(window_ends)):
+        yield from iter_live_events(user.google_token, time_min, time_max, fields=fields, calendar_ids=calendar_ids)
+        return
+
+    # All-day rows are stored at UTC midnight, so widen the SQL window by a day
+    # and do the exact overlap check below in the caller's timezone.
+    slack = datetime.timedelta(days=1)
+    rows = db.query(models.CalendarEvent).filter(
+        models.CalendarEvent.user_id == user.id,
+        models.CalendarEvent.calendar_id.in_(calendar_ids),
+        models.CalendarEvent.start_time < max_utc + slack,
+        models.CalendarEvent.end_time > min_utc - slack
+    ).order_by(models.CalendarEvent.start_time).yield_per(500)
+
+    tz = time_min.tzinfo
+    for row in rows:
+        if row.is_all_day:
+            start = row.start_time.replace(tzinfo=tz)
+            end = row.end_time.replace(tzinfo=tz)
+            if not (start < time_max and end > time_min):
+                continue
+        elif not (row.start_time < max_utc and row.end_time > min_utc):
+            continue
+        yield json.loads(row.raw)
+
+def get_events(db: Session, user: models.User, time_min, time_max, max_staleness=None, force_refresh=False):
+    """Returns the events from iter_events as a list (see there)."""
+    return list(iter_events(db, user, time_min, time_max, max_staleness=max_staleness, force_refresh=force_refresh))
@@ -0,0 +1,634 @@
+import asyncio
+import datetime
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import unquote, urlparse
+import httplib2
+import httpx
+from dateutil import parser, tz as dateutil_tz
+from googleapiclient.errors import HttpError
+
+# In-process stand-ins for the Google Calendar API, for offline runs, tests and
+# benchmarks. Plug one in with calendar_integration.set_backend(); every sync
+# call then goes through FakeService (same surface as the googleapiclient
+# service object) and the async client through FakeCalendar.transport().
+#
+# Supported: events list (timeMin/timeMax, pagination, syncToken with
+# 'cancelled' tombstones and 410 on expired tokens), get, insert (client IDs,
+# 409 on duplicates), patch (If-Match / 412), delete, watch, batch requests,
+# freebusy.query, calendarList and channels.stop. Recurring events are not
+# expanded and `fields` masks are ignored (full resources are returned).
+#
+# Latency and errors can be injected to make benchmarks realistic:
+#   FakeCalendar(latency=(0.05, 0.15), error_rate=0.02, error_statuses=(429, 503))
+
+API_PREFIX = "/calendar/v3"
+
+# Google accepts base32hex characters (a-v, 0-9) for client-chosen event IDs
+EVENT_ID_RE = re.compile(r'^[a-v0-9]{5,1024}$')
+
+ERROR_REASONS = {
+    400: 'invalid', 403: 'rateLimitExceeded', 404: 'notFound', 409: 'duplicate',
+    410: 'deleted', 412: 'conditionNotMet', 429: 'rateLimitExceeded',
+    500: 'backendError', 502: 'backendError', 503: 'backendError', 504: 'backendError',
+}
+
+
+class FakeError(Exception):
+    """An API error from the fake. Adapters turn it into HttpError / an HTTP response."""
+
+    def __init__(self, status, message, reason=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason or ERROR_REASONS.get(status, 'error')
+        self.message = message
+
+    def body(self):
+        return {'error': {
+            'code': self.status,
+            'message': self.message,
+            'errors': [{'domain': 'global', 'reason': self.reason, 'message': self.message}],
+        }}
+
+    def to_http_error(self, uri=None):
+        resp = httplib2.Response({'status': self.status})
+        resp.reason = self.message
+        return HttpError(resp, json.dumps(self.body()).encode('utf-8'), uri=uri)
+
+
+def make_token(account):
+    """Returns stored-token JSON for a fake account (expires in 2100, so no refresh is attempted)."""
+    return json.dumps({
+        'token': f"fake-access-{account}",
+        'refresh_token': account,
+        'token_uri': "https://oauth2.googleapis.com/token",
+        'client_id': "fake",
+        'client_secret': "fake",
+        'scopes': None,
+        'expiry': "2100-01-01T00:00:00Z",
+    })
+
+def _to_utc(value, tz_name=None, default_tz=None):
+    """Parses an RFC 3339 string (or datetime) to an aware UTC datetime; naive values use tz_name."""
+    dt = parser.isoparse(value) if isinstance(value, str) else value
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=dateutil_tz.gettz(tz_name) if tz_name else default_tz)
+    return dt.astimezone(datetime.timezone.utc)
+
+def _rfc3339(dt):
+    return dt.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeCalendar:
+    """
+    In-memory fake of one or more Google accounts' calendars. Thread-safe.
+
+    latency: seconds per request, or a (min, max) range to sample from
+    error_rate: probability that a request fails with one of error_statuses
+    seed: makes the injected latency/errors reproducible
+    timezone: calendar timezone (used for all-day events and naive times)
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_statuses=(503,), seed=None, timezone="Europe/Istanbul"):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.timezone = timezone
+        self.tz = dateutil_tz.gettz(timezone)
+        self.calls = Counter()  # operation name -> requests served (including injected failures)
+        self.lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._sync_floor = 0  # sync tokens from before this sequence number get a 410
+        self._accounts = {}  # access token -> account
+        self._init_storage()
+
+    # --- Storage (overridden by SQLiteFakeCalendar) ---
+
+    def _init_storage(self):
+        self._seq = 0
+        self._events = {}  # (account, calendar_id) -> {event_id: (seq, start_ts, end_ts, event)}
+        self._calendar_list = {}  # account -> {calendar_id: calendarList entry}
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _current_seq(self):
+        return self._seq
+
+    def _get(self, account, calendar_id, event_id):
+        row = self._events.get((account, calendar_id), {}).get(event_id)
+        return row[3] if row else None
+
+    def _put(self, account, calendar_id, event, seq, start_ts, end_ts):
+        self._events.setdefault((account, calendar_id), {})[event['id']] = (seq, start_ts, end_ts, event)
+
+    def _range(self, account, calendar_id, start_ts, end_ts):
+        """Live (not cancelled) events overlapping [start_ts, end_ts), in start order."""
+        rows = [
+            row for row in self._events.get((account, calendar_id), {}).values()
+            if row[3].get('status') != 'cancelled'
+            and (end_ts is None or row[1] < end_ts) and (start_ts is None or row[2] > start_ts)
+        ]
+        rows.sort(key=lambda row: (row[1], row[3]['id']))
+        return [row[3] for row in rows]
+
+    def _changes(self, account, calendar_id, since_seq):
+        """Every event (tombstones included) changed after since_seq, oldest change first."""
+        rows = [row for row in self._events.get((account, calendar_id), {}).values() if row[0] > since_seq]
+        rows.sort(key=lambda row: row[0])
+        return [row[3] for row in rows]
+
+    def _get_calendars(self, account):
+        return list(self._calendar_list.get(account, {}).values())
+
+    def _put_calendar(self, account, entry):
+        self._calendar_list.setdefault(account, {})[entry['id']] = entry
+
+    # --- Accounts & seeding (no latency, no injected errors) ---
+
+    def add_account(self, account):
+        """Registers an account (its primary calendar's ID is the account name). Returns its token JSON."""
+        with self.lock:
+            self._accounts[f"fake-access-{account}"] = account
+            if not any(entry['id'] == account for entry in self._get_calendars(account)):
+                self._put_calendar(account, {
+                    'kind': 'calendar#calendarListEntry', 'id': account, 'summary': account,
+                    'primary': True, 'selected': True, 'accessRole': 'owner', 'timeZone': self.timezone,
+                })
+        return make_token(account)
+
+    def add_calendar(self, account, calendar_id, summary=None, selected=True, access_role='reader'):
+        """Adds a secondary calendar (e.g. a shared course calendar) to the account's calendar list."""
+        with self.lock:
+            self._put_calendar(account, {
+                'kind': 'calendar#calendarListEntry', 'id': calendar_id, 'summary': summary or calendar_id,
+                'selected': selected, 'accessRole': access_role, 'timeZone': self.timezone,
+            })
+
+    def add_event(self, account, summary, start, end, calendar_id='primary', **fields):
+        """Seeds an event. start/end are datetimes (timed) or dates (all-day)."""
+        body = {'summary': summary, **fields}
+        for key, value in (('start', start), ('end', end)):
+            if isinstance(value, datetime.datetime):
+                body[key] = {'dateTime': value.isoformat(), 'timeZone': self.timezone}
+            else:
+                body[key] = {'date': value.isoformat()}
+        return self.insert_event(account, calendar_id, body)
+
+    def expire_sync_tokens(self):
+        """Invalidates every sync token handed out so far (the next incremental sync gets a 410)."""
+        with self.lock:
+            self._sync_floor = self._current_seq() + 1
+
+    def account_for_token(self, access_token):
+        return self._accounts.get(access_token)
+
+    # --- Simulation ---
+
+    def _sample_latency(self):
+        if isinstance(self.latency, (tuple, list)):
+            return self._random.uniform(*self.latency)
+        return self.latency
+
+    def _injected_error(self, operation):
+        self.calls[operation] += 1
+        if self.error_rate and self._random.random() < self.error_rate:
+            status = self._random.choice(self.error_statuses)
+            return FakeError(status, f"Injected {status} error")
+        return None
+
+    # --- API operations (raise FakeError) ---
+
+    def _resolve(self, account, calendar_id):
+        return account if calendar_id == 'primary' else calendar_id
+
+    def _bounds(self, event):
+        """Returns (start_ts, end_ts) in epoch seconds for an event body."""
+        stamps = []
+        for key in ('start', 'end'):
+            value = event.get(key) or {}
+            if 'dateTime' in value:
+                dt = _to_utc(value['dateTime'], value.get('timeZone'), self.tz)
+            elif 'date' in value:
+                day = datetime.date.fromisoformat(value['date'])
+                dt = datetime.datetime.combine(day, datetime.time.min, tzinfo=self.tz)
+            else:
+                raise FakeError(400, f"Missing {key} time.", 'required')
+            stamps.append(dt.timestamp())
+        return stamps[0], stamps[1]
+
+    def _save(self, account, calendar_id, event):
+        start_ts, end_ts = self._bounds(event) if event.get('status') != 'cancelled' else (0, 0)
+        seq = self._next_seq()
+        event['etag'] = f'"{seq}"'
+        event['updated'] = _rfc3339(datetime.datetime.now(datetime.timezone.utc))
+        self._put(account, calendar_id, event, seq, start_ts, end_ts)
+        return event
+
+    def _live_event(self, account, calendar_id, event_id):
+        event = self._get(account, calendar_id, event_id)
+        if event is None:
+            raise FakeError(404, "Not Found")
+        if event.get('status') == 'cancelled':
+            raise FakeError(410, "Resource has been deleted")
+        return event
+
+    def list_events(self, account, calendar_id, params):
+        calendar_id = self._resolve(account, calendar_id)
+        max_results = min(int(params.get('maxResults') or 250), 2500)
+        page_token = params.get('pageToken')
+        sync_token = params.get('syncToken')
+
+        with self.lock:
+            if page_token:
+                offset, snapshot = (int(part) for part in page_token.split(':'))
+            else:
+                offset, snapshot = 0, self._current_seq()
+
+            if sync_token:
+                if params.get('timeMin') or params.get('timeMax') or params.get('orderBy'):
+                    raise FakeError(400, "syncToken cannot be combined with timeMin, timeMax or orderBy.")
+                since = int(sync_token)
+                if since < self._sync_floor:
+                    raise FakeError(410, "Sync token is no longer valid, a full sync is required.", 'fullSyncRequired')
+                events = self._changes(account, calendar_id, since)
+            else:
+                time_min = _to_utc(params['timeMin']).timestamp() if params.get('timeMin') else None
+                time_max = _to_utc(params['timeMax']).timestamp() if params.get('timeMax') else None
+                events = self._range(account, calendar_id, time_min, time_max)
+
+        page = events[offset:offset + max_results]
+        result = {'kind': 'calendar#events', 'timeZone': self.timezone, 'items': [dict(event) for event in page]}
+        if offset + max_results < len(events):
+            result['nextPageToken'] = f"{offset + max_results}:{snapshot}"
+        else:
+            # Changes made while paging come back on the next incremental sync
+            result['nextSyncToken'] = str(snapshot)
+        return result
+
+    def get_event(self, account, calendar_id, event_id):
+        with self.lock:
+            return dict(self._live_event(account, self._resolve(account, calendar_id), event_id))
+
+    def insert_event(self, account, calendar_id, body):
+        calendar_id = self._resolve(account, calendar_id)
+        event_id = body.get('id') or uuid.uuid4().hex
+        if not EVENT_ID_RE.match(event_id):
+            raise FakeError(400, "Invalid resource id value.", 'invalid')
+        with self.lock:
+            if self._get(account, calendar_id, event_id) is not None:
+                raise FakeError(409, "The requested identifier already exists.")
+            now = _rfc3339(datetime.datetime.now(datetime.timezone.utc))
+            event = {'kind': 'calendar#event', 'status': 'confirmed', 'created': now, **body, 'id': event_id}
+            return dict(self._save(account, calendar_id, event))
+
+    def patch_event(self, account, calendar_id, event_id, body, if_match=None):
+        calendar_id = self._resolve(account, calendar_id)
+        with self.lock:
+            event = self._live_event(account, calendar_id, event_id)
+            if if_match and if_match != event['etag']:
+                raise FakeError(412, "Precondition Failed")
+            event = {**event, **body, 'id': event_id}
+            return dict(self._save(account, calendar_id, event))
+
+    def delete_event(self, account, calendar_id, event_id):
+        calendar_id = self._resolve(account, calendar_id)
+        with self.lock:
+            event = self._live_event(account, calendar_id, event_id)
+            # Keep a tombstone so incremental syncs report the deletion
+            self._save(account, calendar_id, {'id': event_id, 'status': 'cancelled', 'kind': event.get('kind')})
+        return ''
+
+    def watch_events(self, account, calendar_id, body):
+        ttl = int((body.get('params') or {}).get('ttl', 604800))
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl)
+        return {
+            'kind': 'api#channel', 'id': body['id'], 'resourceId': f"fake-{uuid.uuid4().hex[:12]}",
+            'resourceUri': f"{API_PREFIX}/calendars/{calendar_id}/events", 'token': body.get('token'),
+            'expiration': str(int(expiration.timestamp() * 1000)),
+        }
+
+    def freebusy(self, account, body):
+        time_min = _to_utc(body['timeMin'])
+        time_max = _to_utc(body['timeMax'])
+        calendars = {}
+        with self.lock:
+            known = {entry['id'] for entry in self._get_calendars(account)}
+            for item in body.get('items', []):
+                calendar_id = self._resolve(account, item['id'])
+                if calendar_id not in known:
+                    calendars[item['id']] = {'errors': [{'domain': 'global', 'reason': 'notFound'}], 'busy': []}
+                    continue
+                busy = []
+                for event in self._range(account, calendar_id, time_min.timestamp(), time_max.timestamp()):
+                    if event.get('transparency') == 'transparent':
+                        continue
+                    start_ts, end_ts = self._bounds(event)
+                    start_ts, end_ts = max(start_ts, time_min.timestamp()), min(end_ts, time_max.timestamp())
+                    # Merge overlapping/touching intervals, like Google does
+                    if busy and start_ts <= busy[-1][1]:
+                        busy[-1][1] = max(busy[-1][1], end_ts)
+                    else:
+                        busy.append([start_ts, end_ts])
+                calendars[item['id']] = {'busy': [
+                    {'start': _rfc3339(datetime.datetime.fromtimestamp(s, datetime.timezone.utc)),
+                     'end': _rfc3339(datetime.datetime.fromtimestamp(e, datetime.timezone.utc))}
+                    for s, e in busy
+                ]}
+        return {'kind': 'calendar#freeBusy', 'timeMin': _rfc3339(time_min), 'timeMax': _rfc3339(time_max), 'calendars': calendars}
+
+    def calendar_list(self, account):
+        with self.lock:
+            return {'kind': 'calendar#calendarList', 'items': [dict(entry) for entry in self._get_calendars(account)]}
+
+    # --- Adapters ---
+
+    def service(self, creds):
+        """Builds a googleapiclient-style service for the account behind the credentials (see calendar_integration)."""
+        account = creds.refresh_token or self.account_for_token(creds.token) or creds.token
+        with self.lock:
+            self._accounts.setdefault(creds.token, account)
+        self.add_account(account)
+        return FakeService(self, account)
+
+    def transport(self):
+        """Returns an httpx transport serving the REST API, for calendar_async's client."""
+
+        async def handle(request):
+            await asyncio.sleep(self._sample_latency())
+            try:
+                status, payload = self._route(request)
+            except FakeError as e:
+                return httpx.Response(e.status, json=e.body())
+            return httpx.Response(status) if payload is None else httpx.Response(status, json=payload)
+
+        return httpx.MockTransport(handle)
+
+    def _route(self, request):
+        """Dispatches one REST request. Returns (status, JSON payload or None)."""
+        path = urlparse(str(request.url)).path.removeprefix(API_PREFIX)
+        parts = [unquote(part) for part in path.split('/') if part]
+        params = dict(request.url.params)
+        body = json.loads(request.content) if request.content else {}
+        method = request.method
+
+        if parts == ['freeBusy'] and method == 'POST':
+            operation, handler = 'freebusy', lambda account: self.freebusy(account, body)
+        elif parts == ['users', 'me', 'calendarList'] and method == 'GET':
+            operation, handler = 'calendar_list', self.calendar_list
+        elif len(parts) == 3 and parts[0] == 'calendars' and parts[2] == 'events' and method in ('GET', 'POST'):
+            calendar_id = parts[1]
+            if method == 'GET':
+                operation, handler = 'list', lambda account: self.list_events(account, calendar_id, params)
+            else:
+                operation, handler = 'insert', lambda account: self.insert_event(account, calendar_id, body)
+        elif len(parts) == 4 and parts[0] == 'calendars' and parts[2] == 'events' and method in ('GET', 'PATCH', 'DELETE'):
+            calendar_id, event_id = parts[1], parts[3]
+            if method == 'GET':
+                operation, handler = 'get', lambda account: self.get_event(account, calendar_id, event_id)
+            elif method == 'PATCH':
+                if_match = request.headers.get('if-match')
+                operation, handler = 'patch', lambda account: self.patch_event(account, calendar_id, event_id, body, if_match)
+            else:
+                operation, handler = 'delete', lambda account: self.delete_event(account, calendar_id, event_id) or None
+        else:
+            raise FakeError(404, "Not Found")
+
+        access_token = request.headers.get('authorization', '').removeprefix('Bearer ')
+        account = self.account_for_token(access_token)
+        if not account:
+            raise FakeError(401, "Invalid Credentials", 'authError')
+        error = self._injected_error(operation)
+        if error:
+            raise error
+        payload = handler(account)
+        return (204, None) if method == 'DELETE' else (200, payload)
+
+
+class SQLiteFakeCalendar(FakeCalendar):
+    """
+    FakeCalendar persisted to a SQLite file, so large seeded calendars survive
+    between benchmark runs and range queries use an index instead of a scan.
+    """
+
+    def __init__(self, path=":memory:", **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+
+    def _init_storage(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                account TEXT, calendar_id TEXT, id TEXT, seq INTEGER, cancelled INTEGER,
+                start_ts REAL, end_ts REAL, body TEXT,
+                PRIMARY KEY (account, calendar_id, id)
+            );
+            CREATE INDEX IF NOT EXISTS ix_events_start ON events (account, calendar_id, cancelled, start_ts);
+            CREATE INDEX IF NOT EXISTS ix_events_seq ON events (account, calendar_id, seq);
+            CREATE TABLE IF NOT EXISTS calendars (account TEXT, id TEXT, body TEXT, PRIMARY KEY (account, id));
+        """)
+        self.conn.commit()
+
+    def _next_seq(self):
+        return self._current_seq() + 1
+
+    def _current_seq(self):
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+
+    def _get(self, account, calendar_id, event_id):
+        row = self.conn.execute(
+            "SELECT body FROM events WHERE account = ? AND calendar_id = ? AND id = ?",
+            (account, calendar_id, event_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, account, calendar_id, event, seq, start_ts, end_ts):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (account, calendar_id, event['id'], seq, int(event.get('status') == 'cancelled'), start_ts, end_ts, json.dumps(event))
+        )
+        self.conn.commit()
+
+    def _range(self, account, calendar_id, start_ts, end_ts):
+        rows = self.conn.execute(
+            "SELECT body FROM events WHERE account = ? AND calendar_id = ? AND cancelled = 0"
+            " AND start_ts < ? AND end_ts > ? ORDER BY start_ts, id",
+            (account, calendar_id, end_ts if end_ts is not None else float('inf'), start_ts if start_ts is not None else float('-inf'))
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _changes(self, account, calendar_id, since_seq):
+        rows = self.conn.execute(
+            "SELECT body FROM events WHERE account = ? AND calendar_id = ? AND seq > ? ORDER BY seq",
+            (account, calendar_id, since_seq)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _get_calendars(self, account):
+        rows = self.conn.execute("SELECT body FROM calendars WHERE account = ? ORDER BY rowid", (account,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _put_calendar(self, account, entry):
+        self.conn.execute("INSERT OR REPLACE INTO calendars VALUES (?, ?, ?)", (account, entry['id'], json.dumps(entry)))
+        self.conn.commit()
+
+
+def from_url(url):
+    """
+    Builds a fake from a CALENDAR_BACKEND value:
+    'memory' or 'sqlite:///path/to/fake.db', optionally followed by
+    '?latency=0.05,0.2&error_rate=0.01&error_statuses=429,503&seed=1'.
+    """
+    base, _, query = url.partition('?')
+    scheme, _, path = base.partition('://')
+    options = dict(part.split('=', 1) for part in query.split('&') if '=' in part)
+    kwargs = {}
+    if 'latency' in options:
+        values = [float(v) for v in options['latency'].split(',')]
+        kwargs['latency'] = tuple(values) if len(values) == 2 else values[0]
+    if 'error_rate' in options:
+        kwargs['error_rate'] = float(options['error_rate'])
+    if 'error_statuses' in options:
+        kwargs['error_statuses'] = tuple(int(v) for v in options['error_statuses'].split(','))
+    if 'seed' in options:
+        kwargs['seed'] = int(options['seed'])
+
+    if scheme == 'memory':
+        return FakeCalendar(**kwargs)
+    if scheme == 'sqlite':
+        return SQLiteFakeCalendar(path.removeprefix('/') or ":memory:", **kwargs)
+    raise ValueError(f"Unknown calendar backend '{url}'")
+
+
+def connect_user(db, user, account=None):
+    """Gives a user without Google credentials a fake account's token (offline mode). Returns the token JSON."""
+    if not user.google_token:
+        user.google_token = make_token(account or user.email or f"user{user.id}")
+        db.commit()
+    return user.google_token
+
+
+# --- googleapiclient-style service ---
+
+class FakeRequest:
+    """Mimics googleapiclient's HttpRequest: mutable headers, execute()."""
+
+    def __init__(self, backend, operation, handler, uri=None):
+        self.backend = backend
+        self.operation = operation
+        self.handler = handler  # fn(headers) -> response
+        self.uri = uri
+        self.headers = {}
+
+    def _run(self):
+        error = self.backend._injected_error(self.operation)
+        if error:
+            raise error.to_http_error(self.uri)
+        try:
+            return self.handler(self.headers)
+        except FakeError as e:
+            raise e.to_http_error(self.uri)
+
+    def execute(self, num_retries=0):
+        time.sleep(self.backend._sample_latency())
+        return self._run()
+
+
+class FakeBatch:
+    """Mimics BatchHttpRequest: one simulated round trip, per-call results through the callback."""
+
+    def __init__(self, backend, callback=None):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self, num_retries=0):
+        time.sleep(self.backend._sample_latency())
+        self.backend.calls['batch'] += 1
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = request._run(), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class _Resource:
+    def __init__(self, service):
+        self.backend = service.backend
+        self.account = service.account
+
+    def _request(self, operation, handler, uri=None):
+        return FakeRequest(self.backend, operation, handler, uri)
+
+
+class _Events(_Resource):
+    def list(self, calendarId, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        return self._request('list', lambda headers: self.backend.list_events(self.account, calendarId, params))
+
+    def get(self, calendarId, eventId, **params):
+        return self._request('get', lambda headers: self.backend.get_event(self.account, calendarId, eventId))
+
+    def insert(self, calendarId, body, **params):
+        return self._request('insert', lambda headers: self.backend.insert_event(self.account, calendarId, body))
+
+    def patch(self, calendarId, eventId, body, **params):
+        return self._request('patch', lambda headers: self.backend.patch_event(
+            self.account, calendarId, eventId, body, headers.get('If-Match')
+        ))
+
+    def delete(self, calendarId, eventId, **params):
+        return self._request('delete', lambda headers: self.backend.delete_event(self.account, calendarId, eventId))
+
+    def watch(self, calendarId, body, **params):
+        return self._request('watch', lambda headers: self.backend.watch_events(self.account, calendarId, body))
+
+
+class _FreeBusy(_Resource):
+    def query(self, body):
+        return self._request('freebusy', lambda headers: self.backend.freebusy(self.account, body))
+
+
+class _CalendarList(_Resource):
+    def list(self, **params):
+        return self._request('calendar_list', lambda headers: self.backend.calendar_list(self.account))
+
+
+class _Channels(_Resource):
+    def stop(self, body):
+        return self._request('channel_stop', lambda headers: '')
+
+
+class FakeService:
+    """Stands in for the object returned by googleapiclient's build('calendar', 'v3')."""
+
+    def __init__(self, backend, account):
+        self.backend = backend
+        self.account = account
+
+    def events(self):
+        return _Events(self)
+
+    def freebusy(self):
+        return _FreeBusy(self)
+
+    def calendarList(self):
+        return _CalendarList(self)
+
+    def channels(self):
+        return _Channels(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.backend, callback)
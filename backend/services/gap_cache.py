@@ -0,0 +1,137 @@
+import datetime
+import threading
+from collections import defaultdict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import models
+
+# Per-user, per-day cache of computed availability (busy intervals, free gaps,
+# schedule events), so repeated availability questions within a chat turn or
+# a planning run are answered from memory.
+#
+# Every entry carries the user's schedule version. The version is bumped on any
+# flush that touches a model availability depends on (fixed schedules, daily
+# overrides, preferences, study blocks, mirrored calendar events) and by the
+# event mirror when Google changes, so a stale entry is never served. Entries
+# also expire after event_mirror.MAX_STALENESS, the mirror's own staleness
+# window, so changes made on Google's side are picked up as soon as the mirror
+# would pick them up.
+
+MAX_ENTRIES = 5000
+
+# Models whose rows feed availability
+TRACKED_MODELS = (models.FixedSchedule, models.DailyOverride, models.Preference, models.StudyBlock, models.CalendarEvent)
+
+_versions = defaultdict(int)
+_global_version = 0
+_cache = {}
+_lock = threading.Lock()
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _current(user_id: int):
+    return (_global_version, _versions[user_id])
+
+def version(user_id: int):
+    """The user's current schedule version."""
+    with _lock:
+        return _current(user_id)
+
+def bump(user_id: int = None):
+    """Invalidates the user's cached availability (every user's if user_id is None)."""
+    global _global_version
+    with _lock:
+        if user_id is None:
+            _global_version += 1
+        else:
+            _versions[user_id] += 1
+
+def get_stats():
+    with _lock:
+        return dict(_stats, entries=len(_cache))
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _max_age():
+    # Imported here: event_mirror imports this module
+    from services import event_mirror
+    return event_mirror.MAX_STALENESS
+
+def _prune(now):
+    """Drops expired and outdated entries (called with the lock held when the cache is full)."""
+    max_age = _max_age()
+    for key in [key for key, (entry_version, stored_at, _) in _cache.items()
+                if stored_at + max_age <= now or entry_version != _current(key[0])]:
+        del _cache[key]
+    if len(_cache) >= MAX_ENTRIES:
+        _cache.clear()
+
+def get_days(user_id: int, kind, days: list, compute):
+    """
+    Returns {day: value} for `days`, from the cache where possible.
+    The missing days are handed to compute(missing_days), which must return {day: value} for them;
+    consecutive missing days arrive together, so compute can fetch them in one go.
+    """
+    current = version(user_id)
+    now = _utcnow()
+    max_age = _max_age()
+    values, missing = {}, []
+    with _lock:
+        for day in days:
+            entry = _cache.get((user_id, kind, day))
+            if entry and entry[0] == current and entry[1] + max_age > now:
+                values[day] = entry[2]
+            else:
+                missing.append(day)
+        _stats['hits'] += len(values)
+        _stats['misses'] += len(missing)
+    if not missing:
+        return values
+
+    # Split the missing days into runs of consecutive days
+    runs = [[missing[0]]]
+    for day in missing[1:]:
+        if day - runs[-1][-1] == datetime.timedelta(days=1):
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+
+    for run in runs:
+        computed = compute(run)
+        values.update(computed)
+        with _lock:
+            # Only cache what was computed against the version that is still current
+            if _current(user_id) == current:
+                if len(_cache) >= MAX_ENTRIES:
+                    _prune(now)
+                for day in run:
+                    _cache[(user_id, kind, day)] = (current, now, computed[day])
+    return values
+
+# --- Invalidation ---
+
+def _user_of(session, obj):
+    user_id = getattr(obj, 'user_id', None)
+    if user_id is not None:
+        return user_id
+    # Study blocks belong to a user through their task
+    task_id = getattr(obj, 'task_id', None)
+    if task_id is not None:
+        with session.no_autoflush:
+            task = session.get(models.Task, task_id)
+        if task is not None:
+            return task.user_id
+    return None
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    users = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, TRACKED_MODELS):
+            users.add(_user_of(session, obj))
+    if None in users:
+        bump()
+    for user_id in users - {None}:
+        bump(user_id)
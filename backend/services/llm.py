@@ -1,10 +1,11 @@
+import asyncio
 import json
 import os
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from openai import OpenAI
 import models, crud, schemas
-from services import scheduler, memory, calendar_integration
+from services import scheduler, memory, calendar_integration, calendar_outbox, event_mirror
 
 # Initialize OpenAI client
 # Expects OPENAI_API_KEY in environment variables
@@ -143,6 +144,17 @@ TOOLS = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "plan_all_tasks",
+            "description": "Schedule ALL open (pending or underplanned) tasks at once, earliest deadline first. Use this when the user wants their whole workload (re)planned, e.g. 'plan my week'.",
+            "parameters": {
+                "type": "object",
+                "properties": {}
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -458,7 +470,8 @@ async def process_user_message(user_message: str, db: Session, user_id: int = 1)
                 function_name = tool_call.function.name
                 function_args = json.loads(tool_call.function.arguments)
                 
-                tool_output = execute_tool(function_name, function_args, db, user_id)
+                # Tools do blocking calendar/DB I/O; keep it off the event loop
+                tool_output = await asyncio.to_thread(execute_tool, function_name, function_args, db, user_id)
                 
                 messages.append({
                     "tool_call_id": tool_call.id,
@@ -488,6 +501,21 @@ async def process_user_message(user_message: str, db: Session, user_id: int = 1)
         print(f"LLM Error: {e}")
         return f"System Malfunction: {str(e)}"
 
+def replan_after_event(db: Session, user_id: int, start_dt, end_dt):
+    """Moves study blocks out of the way of a newly created event; returns what moved (for the LLM)."""
+    try:
+        result = scheduler.replan_interval(db, user_id, start_dt, end_dt)
+    except Exception as e:
+        print(f"Re-planning around new event failed: {e}")
+        return None
+    return {
+        "moved_blocks": [
+            {"block_id": move["block_id"], "new_time": move["new_start"].strftime("%Y-%m-%d %H:%M")}
+            for move in result["moved"]
+        ],
+        "unplaced_block_ids": result["unplaced"]
+    }
+
 def execute_tool(name, args, db: Session, user_id: int):
     print(f"Executing Tool: {name} with {args}")
     
@@ -556,21 +584,16 @@ def execute_tool(name, args, db: Session, user_id: int):
             if not task:
                 return {"error": "Task not found"}
             
-            # Delete associated Google Calendar events
+            # Queue the removal of the associated Google Calendar events, in the same
+            # transaction as the delete (blocks still being inserted are covered too)
             user = crud.get_user(db, user_id)
-            deleted_events = 0
-            if user.google_token and task.study_blocks:
-                for block in task.study_blocks:
-                    if block.google_event_id:
-                        try:
-                            calendar_integration.delete_event(user.google_token, block.google_event_id)
-                            deleted_events += 1
-                        except Exception as e:
-                            print(f"Failed to delete calendar event {block.google_event_id}: {e}")
+            queued_events = calendar_outbox.enqueue_task_delete(db, user_id, task) if user.google_token else 0
             
-            # Now delete the task (cascade deletes study blocks)
+            # Now delete the task (its study blocks are detached from it)
             crud.delete_task(db, args["task_id"])
-            return {"status": "success", "message": f"Task '{task.title}' deleted. {deleted_events} calendar events removed."}
+            if queued_events:
+                calendar_outbox.wake()
+            return {"status": "success", "message": f"Task '{task.title}' deleted. {queued_events} calendar events queued for removal."}
 
         elif name == "delete_calendar_event":
             user = crud.get_user(db, user_id)
@@ -578,7 +601,9 @@ def execute_tool(name, args, db: Session, user_id: int):
                 return {"error": "Google Calendar not connected"}
             
             try:
-                calendar_integration.delete_event(user.google_token, args["event_id"])
+                calendar_integration.delete_event(user.google_token, args["event_id"], db=db, user_id=user_id)
+                event_mirror.mark_stale(db, user_id)
+                db.commit()
                 return {"status": "success", "message": f"Event {args['event_id']} deleted from Google Calendar."}
             except Exception as e:
                 return {"error": f"Failed to delete event: {str(e)}"}
@@ -602,21 +627,20 @@ def execute_tool(name, args, db: Session, user_id: int):
                 end_dt = now + timedelta(days=30)
             
             try:
-                events = calendar_integration.list_events(
+                events = calendar_integration.iter_events(
                     user.google_token, 
                     time_min=start_dt.isoformat(), 
-                    time_max=end_dt.isoformat()
+                    time_max=end_dt.isoformat(),
+                    fields='items(id,summary),nextPageToken',
+                    db=db,
+                    user_id=user_id
                 )
                 
-                deleted = 0
-                for event in events:
-                    event_title = event.get('summary', '').lower()
-                    if title_filter in event_title:
-                        try:
-                            calendar_integration.delete_event(user.google_token, event['id'])
-                            deleted += 1
-                        except Exception as e:
-                            print(f"Failed to delete event {event['id']}: {e}")
+                matching_ids = [event['id'] for event in events if title_filter in event.get('summary', '').lower()]
+                deleted = calendar_integration.delete_events(user.google_token, matching_ids, db=db, user_id=user_id) if matching_ids else 0
+                if deleted:
+                    event_mirror.mark_stale(db, user_id)
+                    db.commit()
                 
                 return {"status": "success", "message": f"Deleted {deleted} events matching '{args['title_contains']}'."}
             except Exception as e:
@@ -673,6 +697,7 @@ def execute_tool(name, args, db: Session, user_id: int):
                     current_start = start_dt
                     block_num = 1
                     total_study_mins = 0
+                    planned_blocks = []
                     
                     while current_start < end_dt:
                         # Calculate block end (either block_length or remaining time)
@@ -683,21 +708,7 @@ def execute_tool(name, args, db: Session, user_id: int):
                             break
                             
                         block_end = current_start + timedelta(minutes=this_block_length)
-                        
-                        # Create this block
-                        block_title = f"{title} (Block {block_num})"
-                        g_event = calendar_integration.create_event(
-                            user.google_token,
-                            summary=block_title,
-                            start_time=current_start,
-                            end_time=block_end,
-                            description=description
-                        )
-                        created_events.append({
-                            "block": block_num,
-                            "time": f"{current_start.strftime('%H:%M')}-{block_end.strftime('%H:%M')}",
-                            "google_event_id": g_event.get("id")
-                        })
+                        planned_blocks.append((block_num, current_start, block_end))
                         
                         total_study_mins += this_block_length
                         block_num += 1
@@ -705,12 +716,39 @@ def execute_tool(name, args, db: Session, user_id: int):
                         # Move to next block (add break time)
                         current_start = block_end + timedelta(minutes=break_length)
                     
+                    # Create all blocks in batched requests
+                    results = calendar_integration.batch_mutate(
+                        user.google_token,
+                        [{
+                            'op': 'insert',
+                            'summary': f"{title} (Block {num})",
+                            'start_time': block_start,
+                            'end_time': block_end,
+                            'description': description
+                        } for num, block_start, block_end in planned_blocks],
+                        db=db,
+                        user_id=user_id
+                    )
+                    failed = [result['error'] for result in results if not result['ok']]
+                    for (num, block_start, block_end), result in zip(planned_blocks, results):
+                        if result['ok']:
+                            created_events.append({
+                                "block": num,
+                                "time": f"{block_start.strftime('%H:%M')}-{block_end.strftime('%H:%M')}",
+                                "google_event_id": result['event'].get("id")
+                            })
+                    if not created_events:
+                        return {"error": f"Failed to create calendar event: {failed[0] if failed else 'no blocks fit'}"}
+                    
+                    event_mirror.mark_stale(db, user_id)
+                    db.commit()
                     return {
                         "status": "success",
                         "message": f"Created {len(created_events)} study blocks ({block_length} mins each with {break_length} min breaks) from {start_time_str} to {end_time_str}.",
                         "blocks": created_events,
                         "total_study_mins": total_study_mins,
-                        "total_blocks": len(created_events)
+                        "total_blocks": len(created_events),
+                        "replanned": replan_after_event(db, user_id, start_dt, end_dt)
                     }
                 else:
                     # Single event (meetings, short sessions, or split_into_blocks=false)
@@ -721,12 +759,15 @@ def execute_tool(name, args, db: Session, user_id: int):
                         end_time=end_dt,
                         description=description
                     )
+                    event_mirror.mark_stale(db, user_id)
+                    db.commit()
                     
                     return {
                         "status": "success",
                         "message": f"Event '{title}' created on {event_date} from {start_time_str} to {end_time_str}.",
                         "google_event_id": g_event.get("id"),
-                        "duration_mins": total_duration_mins
+                        "duration_mins": total_duration_mins,
+                        "replanned": replan_after_event(db, user_id, start_dt, end_dt)
                     }
             except Exception as e:
                 return {"error": f"Failed to create calendar event: {str(e)}"}
@@ -735,7 +776,15 @@ def execute_tool(name, args, db: Session, user_id: int):
             # Trigger the scheduler for this task
             try:
                 result = scheduler.schedule_task(db, args["task_id"])
-                return {"status": "success", "details": result}
+                # Blocks reach Google Calendar in the background (see calendar_outbox)
+                return {"status": "success", "details": result, "note": "Google Calendar sync runs in the background."}
+            except Exception as e:
+                return {"error": f"Scheduling failed: {str(e)}"}
+
+        elif name == "plan_all_tasks":
+            try:
+                result = scheduler.schedule_all_tasks(db, user_id)
+                return {"status": "success", "details": result, "note": "Google Calendar sync runs in the background."}
             except Exception as e:
                 return {"error": f"Scheduling failed: {str(e)}"}
 
@@ -749,7 +798,7 @@ def execute_tool(name, args, db: Session, user_id: int):
             end_date = start_date + timedelta(days=days)
             
             user = crud.get_user(db, user_id)
-            events = scheduler.get_events_for_range(user, start_date, end_date, db=db)
+            events = scheduler.get_cached_events_for_range(user, start_date, end_date, db)
             
             # Format for LLM - include event IDs for Google Calendar events
             formatted_events = []
@@ -773,7 +822,7 @@ def execute_tool(name, args, db: Session, user_id: int):
             
             user = crud.get_user(db, user_id)
             # Fetch events for the WHOLE day, not just from 'now' onwards
-            events = scheduler.get_events_for_range(user, start_of_day, end_of_day, db=db)
+            events = scheduler.get_cached_events_for_range(user, start_of_day, end_of_day, db)
             
             tasks = crud.get_tasks(db, user_id)
             pending_tasks = [t for t in tasks if t.status == "pending"]
@@ -788,11 +837,37 @@ def execute_tool(name, args, db: Session, user_id: int):
 
         # --- Conflict & Preferences ---
         elif name == "get_conflicts":
-            # Placeholder
-            return {"message": "Conflict detection module is online but currently returns no conflicts (Prototype)."}
+            conflicts = scheduler.check_conflicts(db, user_id)
+            if not conflicts:
+                return {"message": "No conflicts: none of your upcoming study blocks overlap other events."}
+            return {
+                "conflict_count": len(conflicts),
+                "conflicts": [{
+                    "block_id": c["block_id"],
+                    "task": c["task_title"],
+                    "block_time": f"{c['block_start'].strftime('%Y-%m-%d %H:%M')}-{c['block_end'].strftime('%H:%M')}",
+                    "conflicts_with": c["event_title"],
+                    "event_time": f"{c['event_start'].strftime('%Y-%m-%d %H:%M')}-{c['event_end'].strftime('%H:%M')}",
+                    "overlap_minutes": c["overlap_minutes"]
+                } for c in conflicts]
+            }
 
         elif name == "replan_conflicts":
-            return {"message": "Conflict resolution module is online. No conflicts to resolve."}
+            try:
+                result = scheduler.resolve_conflicts(db, user_id)
+            except Exception as e:
+                return {"error": f"Conflict resolution failed: {str(e)}"}
+            if not result["conflicts"]:
+                return {"message": "No conflicts to resolve."}
+            return {
+                "status": "success",
+                "moved_blocks": [
+                    {"block_id": move["block_id"], "from": move["old_start"].strftime("%Y-%m-%d %H:%M"), "to": move["new_start"].strftime("%Y-%m-%d %H:%M")}
+                    for move in result["moved"]
+                ],
+                "unplaced_block_ids": result["unplaced"],
+                "note": "Google Calendar sync runs in the background."
+            }
 
         elif name == "find_free_slots":
             # Parse dates
@@ -833,8 +908,8 @@ def execute_tool(name, args, db: Session, user_id: int):
             if not prefs:
                 return {"error": "User preferences not configured."}
             
-            # Get existing events (Google Calendar errors are handled gracefully inside)
-            events = scheduler.get_events_for_range(user, start_dt, end_dt, db=db)
+            # Get busy time and gaps (cached per day; Google Calendar errors are handled gracefully inside)
+            events, gaps = scheduler.get_free_time(user, start_dt, end_dt, db, prefs)
             
             # Format existing events for context (so LLM knows what's blocking)
             blocking_events = []
@@ -845,9 +920,6 @@ def execute_tool(name, args, db: Session, user_id: int):
                     "end": ev["end"].strftime("%H:%M")
                 })
             
-            # Calculate gaps
-            gaps = scheduler.calculate_free_gaps(start_dt, end_dt, events, prefs)
-            
             # Filter by minimum duration and format
             result = []
             for gap_start, gap_end in gaps:
@@ -896,8 +968,7 @@ def execute_tool(name, args, db: Session, user_id: int):
             if not prefs:
                 return {"error": "User preferences not configured."}
             
-            events = scheduler.get_events_for_range(user, start_dt, end_dt, db=db)
-            gaps = scheduler.calculate_free_gaps(start_dt, end_dt, events, prefs)
+            _, gaps = scheduler.get_free_time(user, start_dt, end_dt, db, prefs)
             
             # Filter gaps that can fit the duration
             suitable_gaps = []
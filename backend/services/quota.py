@@ -0,0 +1,94 @@
+import random
+import threading
+import time
+
+# Google Calendar quota handling shared by the sync and async clients:
+# a per-user token bucket that paces requests, the retry/backoff policy for
+# rate-limit, transient server and network errors, and usage counters.
+
+# Sustained request rate per user. Google's default per-user quota is
+# 600 requests/minute; stay a little under it.
+RATE_PER_SECOND = 8.0
+# Requests that may go out back to back (one full batch request fits)
+BURST = 50
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds; doubles every attempt
+BACKOFF_MAX = 32.0
+
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket. reserve() never blocks; it says how long to wait."""
+
+    def __init__(self, rate=RATE_PER_SECOND, capacity=BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, cost=1):
+        """Takes `cost` tokens (going into debt if needed) and returns the seconds to wait before sending."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= cost
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def penalize(self, seconds):
+        """Google pushed back: stop handing out tokens for `seconds`."""
+        with self.lock:
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+_stats = {
+    'requests': 0,  # API calls sent (each call inside a batch counts)
+    'retries': 0,
+    'rate_limited': 0,  # 429 / 403 rateLimitExceeded responses
+    'server_errors': 0,  # 5xx responses
+    'network_errors': 0,  # timeouts and dropped connections
+    'failures': 0,  # calls that failed for good
+    'throttled_seconds': 0.0,  # time spent waiting on the bucket
+}
+_stats_lock = threading.Lock()
+
+
+def get_bucket(key):
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket()
+        return bucket
+
+def record(counter, amount=1):
+    with _stats_lock:
+        _stats[counter] += amount
+
+def get_stats():
+    """Returns a snapshot of the quota counters."""
+    with _stats_lock:
+        return dict(_stats)
+
+def classify(status, reason=None):
+    """Returns the counter for a retryable error response ('rate_limited' or 'server_errors'), or None."""
+    if status == 429 or (status == 403 and reason in RATE_LIMIT_REASONS):
+        return 'rate_limited'
+    if status in RETRYABLE_STATUSES:
+        return 'server_errors'
+    return None
+
+def backoff_delay(attempt, retry_after=None):
+    """Exponential backoff with jitter; honours a Retry-After header when Google sends one."""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) + random.uniform(0, 1)
@@ -1,151 +1,306 @@
+import bisect
 import datetime
+import heapq
+import os
 from sqlalchemy.orm import Session
 import models, crud
-from services import calendar_integration
+from services import availability, calendar_integration, calendar_outbox, event_mirror, gap_cache, weekly_template
 from dateutil import parser
 import pytz
 
+# Free-gap engine behind calculate_free_gaps: "index" (sorted busy intervals,
+# exact to the second) or "bitmap" (services/availability.py, NumPy minute
+# arrays; whole minutes, cost independent of how events overlap)
+GAP_ENGINE = os.getenv("GAP_ENGINE", "index")
+
 # Helper to parse HH:MM to time object
 def parse_time_str(time_str):
     return datetime.datetime.strptime(time_str, "%H:%M").time()
 
-def get_events_for_range(user: models.User, start_dt: datetime.datetime, end_dt: datetime.datetime, db: Session = None):
-    """Fetches events from Google Calendar AND Fixed Schedules for the given range."""
+def normalize_google_event(event: dict, tz):
+    """Converts a Google event resource into the scheduler's {'start', 'end', 'title', ...} shape."""
+    # Handle 'dateTime' (Timed events)
+    if 'dateTime' in event['start']:
+        start = parser.isoparse(event['start']['dateTime'])
+        end = parser.isoparse(event['end']['dateTime'])
+        return {
+            'start': start, 
+            'end': end, 
+            'title': event.get('summary', 'Busy'),
+            'google_event_id': event.get('id'),
+            'source': 'google'
+        }
+    
+    # Handle 'date' (All-day events)
+    # All day events are YYYY-MM-DD
+    start_date = datetime.datetime.strptime(event['start']['date'], "%Y-%m-%d").date()
+    end_date = datetime.datetime.strptime(event['end']['date'], "%Y-%m-%d").date()
+    
+    # Create start/end times for the all-day event
+    # Note: Google Calendar all-day events end on the *next* day (exclusive)
+    start = datetime.datetime.combine(start_date, datetime.time.min).replace(tzinfo=tz)
+    # We subtract 1 second to keep it within the day for display/logic purposes if needed, 
+    # or keep it as midnight next day. Let's keep it as midnight next day but ensure logic handles it.
+    end = datetime.datetime.combine(end_date, datetime.time.min).replace(tzinfo=tz)
+    
+    return {
+        'start': start, 
+        'end': end, 
+        'title': event.get('summary', 'All Day Event'),
+        'google_event_id': event.get('id'),
+        'source': 'google'
+    }
+
+def iter_google_events(user: models.User, start_dt: datetime.datetime, end_dt: datetime.datetime, db: Session = None, force_refresh: bool = False):
+    """Yields normalized Google Calendar events for the range, in start order, from all selected calendars.
+    
+    With a db session, events are served from the local mirror (synced
+    incrementally when stale, or always with force_refresh=True). Without one,
+    every calendar is fetched live and concurrently, then merged.
+    """
+    if not user.google_token:
+        return
+    
+    if db:
+        events = event_mirror.iter_events(db, user, start_dt, end_dt, force_refresh=force_refresh, fields=calendar_integration.SCHEDULER_FIELDS)
+    else:
+        events = event_mirror.iter_live_events(user.google_token, start_dt, end_dt, fields=calendar_integration.SCHEDULER_FIELDS)
+    
+    # Use start_dt timezone if available, else UTC (for all-day events)
+    tz = start_dt.tzinfo or datetime.timezone.utc
+    for event in events:
+        if 'dateTime' in event['start'] or 'date' in event['start']:
+            yield normalize_google_event(event, tz)
+
+def get_events_for_range(user: models.User, start_dt: datetime.datetime, end_dt: datetime.datetime, db: Session = None, force_refresh: bool = False, include_google: bool = True):
+    """Fetches events from Google Calendar AND Fixed Schedules for the given range.
+    Google events come from iter_google_events (every selected calendar; the local mirror when db is given).
+    With include_google=False only the local ones (fixed schedules, commute, dinner) are returned.
+    """
     normalized_events = []
 
     # 1. Google Calendar Events
-    if user.google_token:
+    if include_google:
         try:
-            events = calendar_integration.list_events(
-                user.google_token, 
-                time_min=start_dt.isoformat(), 
-                time_max=end_dt.isoformat()
-            )
-            for event in events:
-                # Handle 'dateTime' (Timed events)
-                if 'dateTime' in event['start']:
-                    start = parser.isoparse(event['start']['dateTime'])
-                    end = parser.isoparse(event['end']['dateTime'])
-                    normalized_events.append({
-                        'start': start, 
-                        'end': end, 
-                        'title': event.get('summary', 'Busy'),
-                        'google_event_id': event.get('id'),
-                        'source': 'google'
-                    })
-                # Handle 'date' (All-day events)
-                elif 'date' in event['start']:
-                    # All day events are YYYY-MM-DD
-                    start_date = datetime.datetime.strptime(event['start']['date'], "%Y-%m-%d").date()
-                    end_date = datetime.datetime.strptime(event['end']['date'], "%Y-%m-%d").date()
-                    
-                    # Convert to datetime (Start of day to End of day)
-                    # Use start_dt timezone if available, else local
-                    tz = start_dt.tzinfo or datetime.timezone.utc
-                    
-                    # Create start/end times for the all-day event
-                    # Note: Google Calendar all-day events end on the *next* day (exclusive)
-                    start = datetime.datetime.combine(start_date, datetime.time.min).replace(tzinfo=tz)
-                    # We subtract 1 second to keep it within the day for display/logic purposes if needed, 
-                    # or keep it as midnight next day. Let's keep it as midnight next day but ensure logic handles it.
-                    end = datetime.datetime.combine(end_date, datetime.time.min).replace(tzinfo=tz)
-                    
-                    normalized_events.append({
-                        'start': start, 
-                        'end': end, 
-                        'title': event.get('summary', 'All Day Event'),
-                        'google_event_id': event.get('id'),
-                        'source': 'google'
-                    })
+            for event in iter_google_events(user, start_dt, end_dt, db=db, force_refresh=force_refresh):
+                normalized_events.append(event)
         except Exception as e:
             print(f"Google Calendar Fetch Error: {e}")
 
-    # 2. Fixed Schedules (Classes/Work)
+    # 2. Fixed Schedules (Classes/Work), commute and dinner
     if db:
-        fixed_schedules = crud.get_fixed_schedules(db, user.id)
-        # Map day names to weekday numbers (Monday=0, Sunday=6)
-        day_map = {
-            "Monday": 0, "Tuesday": 1, "Wednesday": 2, "Thursday": 3, 
-            "Friday": 4, "Saturday": 5, "Sunday": 6
-        }
-        
-        # Iterate through each day in the range
-        current_day = start_dt.date()
-        end_day = end_dt.date()
-        
-        while current_day <= end_day:
-            weekday = current_day.weekday()
-            
-            # Track daily campus blocks (University + Work) for commute calculation
-            campus_starts = []
-            campus_ends = []
-            
-            for schedule in fixed_schedules:
-                if day_map.get(schedule.day_of_week) == weekday:
-                    # Create datetime for this specific instance
-                    start_time = parse_time_str(schedule.start_time)
-                    end_time = parse_time_str(schedule.end_time)
-                    
-                    # Combine with current date and timezone
-                    tz = start_dt.tzinfo
-                    instance_start = datetime.datetime.combine(current_day, start_time).replace(tzinfo=tz)
-                    instance_end = datetime.datetime.combine(current_day, end_time).replace(tzinfo=tz)
-                    
-                    normalized_events.append({'start': instance_start, 'end': instance_end, 'title': schedule.title})
-                    
-                    # Treat both University and Work as "Campus" activities that require commute
-                    if schedule.category in ["university", "work"]:
-                        campus_starts.append(instance_start)
-                        campus_ends.append(instance_end)
-            
-            # Add Commute Blocks (Before first campus activity, After last campus activity)
-            if campus_starts and user.preferences:
-                commute_mins = user.preferences.commute_duration_mins or 90
-                first_activity = min(campus_starts)
-                last_activity = max(campus_ends)
-                
-                # Check for daily overrides
-                date_str = current_day.strftime("%Y-%m-%d")
-                overrides = crud.get_daily_overrides(db, user.id, date_str) if db else []
-                override_map = {o.override_type: o.value for o in overrides}
-                
-                # Check for skip_commute override
-                if override_map.get("skip_commute") != "true":
-                    # Check for custom departure time override
-                    if "departure_time" in override_map:
-                        # User specified exact departure time
-                        dep_time = parse_time_str(override_map["departure_time"])
-                        commute_to_start = datetime.datetime.combine(current_day, dep_time).replace(tzinfo=tz)
-                    else:
-                        # Default: commute_mins before first activity
-                        commute_to_start = first_activity - datetime.timedelta(minutes=commute_mins)
-                    
-                    # Commute To Campus
-                    normalized_events.append({'start': commute_to_start, 'end': first_activity, 'title': "Commute"})
-                    
-                    # Commute Back Home
-                    commute_back_end = last_activity + datetime.timedelta(minutes=commute_mins)
-                    normalized_events.append({'start': last_activity, 'end': commute_back_end, 'title': "Commute"})
-            
-            # Add Dinner Block (if configured and not skipped)
-            if user.preferences and user.preferences.dinner_time:
-                # Check for skip_dinner override
-                date_str = current_day.strftime("%Y-%m-%d")
-                overrides = crud.get_daily_overrides(db, user.id, date_str) if db else []
-                override_map = {o.override_type: o.value for o in overrides}
-                
-                if override_map.get("skip_dinner") != "true":
-                    dinner_time = parse_time_str(user.preferences.dinner_time)
-                    tz = start_dt.tzinfo
-                    dinner_start = datetime.datetime.combine(current_day, dinner_time).replace(tzinfo=tz)
-                    # Assume 1 hour for dinner
-                    dinner_end = dinner_start + datetime.timedelta(hours=1)
-                    normalized_events.append({'start': dinner_start, 'end': dinner_end, 'title': "Dinner"})
-
-            current_day += datetime.timedelta(days=1)
+        normalized_events.extend(iter_local_events(user, start_dt, end_dt, db))
 
     return normalized_events
 
+def iter_local_events(user: models.User, start_dt: datetime.datetime, end_dt: datetime.datetime, db: Session):
+    """Yields the fixed schedule, commute and dinner events for the range, one day at a time (days are expanded only as they are consumed)."""
+    # Stamped from the user's compiled weekly template
+    template = weekly_template.get_template(db, user)
+    tz = start_dt.tzinfo
+    commute = datetime.timedelta(minutes=template.commute_mins)
+    # Every override in the range, in one query: {date: {override_type: value}}
+    overrides_by_date = crud.get_daily_overrides_for_range(
+        db, user.id, start_dt.date().isoformat(), end_dt.date().isoformat()
+    )
+
+    # Iterate through each day in the range
+    current_day = start_dt.date()
+    end_day = end_dt.date()
+
+    while current_day <= end_day:
+        day = template.days[current_day.weekday()]
+        midnight = weekly_template.day_start(current_day, tz)
+        override_map = overrides_by_date.get(current_day.isoformat(), {})
+
+        for start_min, end_min, title in day.blocks:
+            yield {
+                'start': midnight + datetime.timedelta(minutes=start_min),
+                'end': midnight + datetime.timedelta(minutes=end_min),
+                'title': title
+            }
+
+        # Add Commute Blocks (Before first campus activity, After last campus activity)
+        if day.campus_start is not None and user.preferences:
+            first_activity = midnight + datetime.timedelta(minutes=day.campus_start)
+            last_activity = midnight + datetime.timedelta(minutes=day.campus_end)
+
+            # Check for skip_commute override
+            if override_map.get("skip_commute") != "true":
+                # Check for custom departure time override
+                if "departure_time" in override_map:
+                    # User specified exact departure time
+                    commute_to_start = midnight + datetime.timedelta(minutes=weekly_template.to_minutes(override_map["departure_time"]))
+                else:
+                    # Default: commute_mins before first activity
+                    commute_to_start = first_activity - commute
+
+                # Commute To Campus
+                yield {'start': commute_to_start, 'end': first_activity, 'title': "Commute"}
+
+                # Commute Back Home
+                yield {'start': last_activity, 'end': last_activity + commute, 'title': "Commute"}
+
+        # Add Dinner Block (if configured and not skipped)
+        if template.dinner_start is not None and user.preferences:
+            # Check for skip_dinner override
+            if override_map.get("skip_dinner") != "true":
+                dinner_start = midnight + datetime.timedelta(minutes=template.dinner_start)
+                # Assume 1 hour for dinner
+                dinner_end = dinner_start + datetime.timedelta(minutes=weekly_template.DINNER_MINS)
+                yield {'start': dinner_start, 'end': dinner_end, 'title': "Dinner"}
+
+        current_day += datetime.timedelta(days=1)
+
+
+def get_busy_for_range(user: models.User, start_dt: datetime.datetime, end_dt: datetime.datetime, db: Session = None):
+    """Busy intervals for availability checks, in the same shape as get_events_for_range.
+    
+    Google Calendar time comes from one FreeBusy query over every selected
+    calendar (compact, merged ranges titled "Busy", without IDs); fixed
+    schedules, commute and dinner are added locally. Falls back to the full
+    event listing if the FreeBusy query fails.
+    """
+    busy = []
+    if user.google_token:
+        try:
+            for start, end in calendar_integration.query_free_busy(user.google_token, start_dt, end_dt, db=db, user_id=user.id):
+                busy.append({'start': start, 'end': end, 'title': "Busy", 'source': 'google'})
+        except Exception as e:
+            print(f"FreeBusy query failed, falling back to event listing: {e}")
+            return get_events_for_range(user, start_dt, end_dt, db)
+    
+    busy.extend(get_events_for_range(user, start_dt, end_dt, db, include_google=False))
+    return busy
+
+def _day_start(day: datetime.date, tz):
+    return datetime.datetime.combine(day, datetime.time()).replace(tzinfo=tz)
+
+def _days_between(start_dt: datetime.datetime, end_dt: datetime.datetime):
+    first = start_dt.date()
+    # An end at midnight does not reach into that day
+    last = max(first, (end_dt - datetime.timedelta(microseconds=1)).astimezone(start_dt.tzinfo).date())
+    return [first + datetime.timedelta(days=i) for i in range((last - first).days + 1)]
+
+def _by_day(items, days, tz):
+    """Buckets {'start', 'end'} dicts into every day (of `days`) they overlap."""
+    buckets = {day: [] for day in days}
+    for item in items:
+        day = max(item['start'].astimezone(tz).date(), days[0])
+        last = min((item['end'] - datetime.timedelta(microseconds=1)).astimezone(tz).date(), days[-1])
+        while day <= last:
+            buckets[day].append(item)
+            day += datetime.timedelta(days=1)
+    return buckets
+
+def _in_range(items, start_dt, end_dt):
+    """Items overlapping [start_dt, end_dt), once each (multi-day items sit in several day buckets), by start."""
+    seen, result = set(), []
+    for item in items:
+        key = (item['start'], item['end'], item.get('title'), item.get('google_event_id'))
+        if key in seen or item['end'] <= start_dt or item['start'] >= end_dt:
+            continue
+        seen.add(key)
+        result.append(item)
+    result.sort(key=lambda item: item['start'])
+    return result
+
+def get_free_time(user: models.User, start_dt: datetime.datetime, end_dt: datetime.datetime, db: Session, prefs: models.Preference):
+    """
+    Busy time and free gaps for the range, as (busy, gaps): busy is get_busy_for_range plus the
+    study blocks still queued for Google, gaps what calculate_free_gaps makes of it.
+    Computed for whole days and cached per day (services/gap_cache.py) until the user's schedule
+    changes, so repeated availability questions skip the calendar entirely.
+    The returned event dicts are shared with the cache; don't modify them.
+    """
+    tz = start_dt.tzinfo
+    days = _days_between(start_dt, end_dt)
+
+    def compute(run):
+        span_start, span_end = _day_start(run[0], tz), _day_start(run[-1] + datetime.timedelta(days=1), tz)
+        busy = get_busy_for_range(user, span_start, span_end, db)
+        busy.extend(unsynced_block_events(db, user.id, span_start))
+        gaps = {day: [] for day in run}
+        for gap in calculate_free_gaps(span_start, span_end, busy, prefs):
+            gaps[gap[0].astimezone(tz).date()].append(gap)
+        busy_by_day = _by_day(busy, run, tz)
+        return {day: (tuple(busy_by_day[day]), tuple(gaps[day])) for day in run}
+
+    per_day = gap_cache.get_days(user.id, ("free", str(tz), prefs.wake_time, prefs.sleep_time), days, compute)
+
+    busy, gaps = [], []
+    for day in days:
+        day_busy, day_gaps = per_day[day]
+        busy.extend(day_busy)
+        for gap_start, gap_end in day_gaps:
+            gap_start, gap_end = max(gap_start, start_dt), min(gap_end, end_dt)
+            if gap_end > gap_start:
+                gaps.append((gap_start, gap_end))
+    return _in_range(busy, start_dt, end_dt), gaps
+
+# Streaming planners fetch busy time this many days at a time
+PLANNING_WINDOW = datetime.timedelta(days=7)
+
+def _windows(start_dt: datetime.datetime, end_dt: datetime.datetime, size: datetime.timedelta = PLANNING_WINDOW):
+    """Splits a range into consecutive windows that break at local midnight (gaps never span midnight)."""
+    window_start = start_dt
+    while window_start < end_dt:
+        window_end = min(end_dt, _day_start((window_start + size).date(), start_dt.tzinfo))
+        yield window_start, window_end
+        window_start = window_end
+
+def iter_free_time(user: models.User, start_dt: datetime.datetime, end_dt: datetime.datetime, db: Session, prefs: models.Preference, window: datetime.timedelta = PLANNING_WINDOW):
+    """
+    Yields the free gaps of get_free_time in order, computing (or fetching from the cache) one
+    window of days at a time, so a consumer that stops early never pays for the later days.
+    """
+    for window_start, window_end in _windows(start_dt, end_dt, window):
+        _, gaps = get_free_time(user, window_start, window_end, db, prefs)
+        yield from gaps
+
+def get_cached_events_for_range(user: models.User, start_dt: datetime.datetime, end_dt: datetime.datetime, db: Session):
+    """get_events_for_range (with the local mirror), cached per day like get_free_time. Events overlapping the range, by start."""
+    tz = start_dt.tzinfo
+    days = _days_between(start_dt, end_dt)
+
+    def compute(run):
+        span_start, span_end = _day_start(run[0], tz), _day_start(run[-1] + datetime.timedelta(days=1), tz)
+        events_by_day = _by_day(get_events_for_range(user, span_start, span_end, db=db), run, tz)
+        return {day: tuple(events_by_day[day]) for day in run}
+
+    per_day = gap_cache.get_days(user.id, ("events", str(tz)), days, compute)
+    return _in_range([event for day in days for event in per_day[day]], start_dt, end_dt)
+
+class BusyIndex:
+    """
+    Busy time as sorted, merged, non-overlapping intervals, built once in O(n log n).
+    Because the merged intervals are disjoint, their ends are sorted too, so the
+    intervals touching a window are found with one bisect: O(log n + k).
+    """
+
+    def __init__(self, events):
+        starts, ends = [], []
+        for start, end in sorted((event['start'], event['end']) for event in events):
+            if end <= start:
+                continue
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, window_start, window_end):
+        """Yields the (start, end) intervals overlapping [window_start, window_end), in order."""
+        i = bisect.bisect_right(self.ends, window_start)
+        while i < len(self.starts) and self.starts[i] < window_end:
+            yield self.starts[i], self.ends[i]
+            i += 1
+
 def calculate_free_gaps(
     start_dt: datetime.datetime, 
     end_dt: datetime.datetime, 
@@ -156,11 +311,26 @@ def calculate_free_gaps(
     Finds free time slots between start_dt and end_dt, respecting:
     - Existing events
     - Wake/Sleep times
+    The events are indexed once (BusyIndex), so each day costs O(log n + k)
+    instead of a scan over every event. With GAP_ENGINE=bitmap the NumPy
+    minute-array engine answers instead.
     """
-    gaps = []
-    
+    if GAP_ENGINE == "bitmap":
+        return availability.free_gaps(
+            start_dt, end_dt, existing_events, parse_time_str(preferences.wake_time), parse_time_str(preferences.sleep_time)
+        )
+    return list(iter_free_gaps(start_dt, end_dt, existing_events, preferences))
+
+def iter_free_gaps(
+    start_dt: datetime.datetime,
+    end_dt: datetime.datetime,
+    existing_events: list,
+    preferences: models.Preference
+):
+    """Generator variant of calculate_free_gaps: yields the gaps in order, expanding one day at a time as they are consumed."""
     wake_time = parse_time_str(preferences.wake_time)
     sleep_time = parse_time_str(preferences.sleep_time)
+    busy = BusyIndex(existing_events)
     
     # Iterate day by day
     current_day = start_dt.date()
@@ -187,35 +357,73 @@ def calculate_free_gaps(
             current_day += datetime.timedelta(days=1)
             continue
 
-        # Find events that overlap with this day's window
-        day_events = []
-        for event in existing_events:
-            ev_start = event['start']
-            ev_end = event['end']
-            # Check overlap
-            if ev_end > day_start and ev_start < day_end:
-                # Clip event to the window
-                clamped_start = max(ev_start, day_start)
-                clamped_end = min(ev_end, day_end)
-                day_events.append((clamped_start, clamped_end))
-        
-        # Sort events by start time
-        day_events.sort(key=lambda x: x[0])
-        
-        # Compute gaps between events
+        # Compute gaps between the (merged, already sorted) busy intervals in this day's window
         cursor = day_start
-        for ev_start, ev_end in day_events:
+        for ev_start, ev_end in busy.overlapping(day_start, day_end):
             if ev_start > cursor:
-                gaps.append((cursor, ev_start))
+                yield cursor, ev_start
             cursor = max(cursor, ev_end)
             
         # Add final gap after last event
         if cursor < day_end:
-            gaps.append((cursor, day_end))
+            yield cursor, day_end
             
         current_day += datetime.timedelta(days=1)
-        
-    return gaps
+
+def unsynced_block_events(db: Session, user_id: int, now: datetime.datetime):
+    """
+    Future StudyBlocks without a Google event, as busy events: still queued, failed to sync, or never
+    pushed (no Google account). Synced ones come back from Google.
+    """
+    unsynced_blocks = db.query(models.StudyBlock).join(models.Task).filter(
+        models.Task.user_id == user_id,
+        models.StudyBlock.google_event_id.is_(None),
+        models.StudyBlock.end_time > now.replace(tzinfo=None)
+    ).all()
+    return [{
+        'start': block.start_time.replace(tzinfo=now.tzinfo),
+        'end': block.end_time.replace(tzinfo=now.tzinfo),
+        'title': f"Study: {block.task.title}"
+    } for block in unsynced_blocks]
+
+def block_summary(task: models.Task):
+    """Google Calendar title for a task's study blocks."""
+    summary = f"Study: {task.title}"
+    if task.course_tag:
+        summary += f" ({task.course_tag})"
+    return summary
+
+def study_load(db: Session, user_id: int, start_dt: datetime.datetime, end_dt: datetime.datetime):
+    """Study minutes already planned per local day, for the days from start_dt to end_dt: {date: minutes}."""
+    tz = start_dt.tzinfo
+    first_day = datetime.datetime.combine(start_dt.date(), datetime.time())
+    after_last_day = datetime.datetime.combine(end_dt.astimezone(tz).date() + datetime.timedelta(days=1), datetime.time())
+    return crud.get_study_minutes_by_day(db, user_id, first_day, after_last_day)
+
+def allocate_blocks(task_id: int, gaps: list, needed_minutes: int, block_len: int, deadline: datetime.datetime = None, daily_load: dict = None, max_daily: int = None):
+    """
+    Carves study blocks for one task off the front of `gaps` (sorted [start, end] lists, updated
+    in place; any iterable, only pulled until the task is covered), earliest first and ending by `deadline`. With max_daily set, no day's
+    study minutes (`daily_load`, {date: minutes}, also updated in place) go over it.
+    Returns the new, unsaved StudyBlocks.
+    """
+    block_delta = datetime.timedelta(minutes=block_len)
+    if daily_load is None:
+        daily_load = {}
+    blocks = []
+    for gap in gaps:
+        if needed_minutes <= 0 or (deadline and gap[0] >= deadline):
+            break
+        gap_end = min(gap[1], deadline) if deadline else gap[1]
+        day = gap[0].date()
+        while needed_minutes > 0 and gap[0] + block_delta <= gap_end:
+            if max_daily and daily_load.get(day, 0) + block_len > max_daily:
+                break  # this day is full; try the next gap
+            blocks.append(models.StudyBlock(task_id=task_id, start_time=gap[0], end_time=gap[0] + block_delta))
+            gap[0] += block_delta
+            needed_minutes -= block_len
+            daily_load[day] = daily_load.get(day, 0) + block_len
+    return blocks
 
 def schedule_task(db: Session, task_id: int):
     """
@@ -224,7 +432,8 @@ def schedule_task(db: Session, task_id: int):
     2. Fetch calendar events.
     3. Calculate gaps.
     4. Create StudyBlocks.
-    5. Push to Google Calendar.
+    5. Queue them for Google Calendar (pushed by the calendar_outbox worker,
+       so this returns as soon as the plan is committed).
     """
     task = crud.get_task(db, task_id)
     
@@ -246,141 +455,409 @@ def schedule_task(db: Session, task_id: int):
     if now >= deadline:
         raise ValueError("Deadline has passed")
 
-    # 1. Fetch Existing Events (Google + Fixed)
-    existing_events = get_events_for_range(user, now, deadline, db)
-    
-    # 2. Also fetch existing StudyBlocks for OTHER tasks to treat them as busy
-    # (For this prototype, we might skip this optimization or just rely on Google Calendar if we sync immediately)
-    # Let's rely on Google Calendar events since we push them there.
-    
-    # 3. Calculate Gaps
-    gaps = calculate_free_gaps(now, deadline, existing_events, prefs)
+    # 1-3. Busy time (Google free/busy, fixed schedules, study blocks still queued
+    # for Google) and the gaps between it, from the availability cache. Lazily:
+    # the allocator stops pulling (and fetching later days) once the task is covered
+    gaps = ([gap_start, gap_end] for gap_start, gap_end in iter_free_time(user, now, deadline, db, prefs))
     
-    # 4. Allocate Blocks
+    # 4. Allocate Blocks, keeping every day under max_study_minutes_per_day
     needed_minutes = task.total_required_time - task.scheduled_minutes
     block_len = prefs.study_block_length
-    max_daily = prefs.max_study_minutes_per_day
-    
-    # Track daily usage (simple approximation)
-    # In a real app, we'd query DB for existing study blocks per day.
-    # Here we assume we are starting fresh or just counting what we add now.
-    # TODO: Fetch existing daily usage to respect max_daily properly.
-    
-    new_blocks = []
+    daily_load = study_load(db, user.id, now, deadline)
+    new_blocks = allocate_blocks(task.id, gaps, needed_minutes, block_len, deadline, daily_load, prefs.max_study_minutes_per_day)
+
+    # 5. Persist the plan as one unit of work: the blocks, their outbox rows and the
+    # task update go in a single transaction (one commit), so it is all or nothing
+    scheduled_count = len(new_blocks) * block_len
+    try:
+        db.add_all(new_blocks)
+        db.flush()  # block ids for the outbox rows
+
+        # Queue the Google Calendar events in the same transaction as the plan
+        if new_blocks and user.google_token:
+            summary = block_summary(task)
+            for block in new_blocks:
+                calendar_outbox.enqueue_block_insert(db, user.id, block, summary, description="Auto-scheduled by Ultron")
+
+        # Update Task
+        task.scheduled_minutes += scheduled_count
+        if task.scheduled_minutes >= task.total_required_time:
+            task.status = "scheduled"
+        else:
+            task.status = "underplanned"
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    calendar_outbox.wake()
     
-    for gap_start, gap_end in gaps:
-        if needed_minutes <= 0:
-            break
-            
-        gap_duration = (gap_end - gap_start).total_seconds() / 60
-        
-        # While we can fit a block in this gap
-        current_block_start = gap_start
-        
-        while gap_duration >= block_len and needed_minutes > 0:
-            # Create a block
-            block_end = current_block_start + datetime.timedelta(minutes=block_len)
-            
-            # Create DB Object
-            new_block = models.StudyBlock(
-                task_id=task.id,
-                start_time=current_block_start,
-                end_time=block_end
-            )
-            new_blocks.append(new_block)
-            
-            # Update counters
-            needed_minutes -= block_len
-            gap_duration -= block_len
-            current_block_start = block_end
-            
-            # Add a small break? (Optional, not in spec)
-            
-    # 5. Commit and Sync
-    scheduled_count = 0
-    for block in new_blocks:
-        # Save to DB
-        db.add(block)
-        db.commit() # Commit to get ID?
-        
-        # Sync to Google Calendar
-        if user.google_token:
-            try:
-                summary = f"Study: {task.title}"
-                if task.course_tag:
-                    summary += f" ({task.course_tag})"
-                    
-                g_event = calendar_integration.create_event(
-                    user.google_token,
-                    summary=summary,
-                    start_time=block.start_time,
-                    end_time=block.end_time,
-                    description="Auto-scheduled by Ultron"
-                )
-                block.google_event_id = g_event.get('id')
-                db.add(block) # Update with ID
-            except Exception as e:
-                print(f"Failed to sync block to Google Calendar: {e}")
-        
-        scheduled_count += block_len
+    return {
+        "scheduled_minutes": scheduled_count,
+        "blocks_created": len(new_blocks),
+        "block_ids": [block.id for block in new_blocks],
+        "sync_status": "pending" if new_blocks and user.google_token else None
+    }
 
-    # Update Task
-    task.scheduled_minutes += scheduled_count
-    if task.scheduled_minutes >= task.total_required_time:
-        task.status = "scheduled"
-    else:
-        task.status = "underplanned"
-        
+# Batch planning: how much earlier than its real deadline a task counts as due
+PRIORITY_LEAD = {
+    "high": datetime.timedelta(days=1),
+    "normal": datetime.timedelta(0),
+}
+
+def schedule_all_tasks(db: Session, user_id: int):
+    """
+    Plans every open task of the user (pending or underplanned) in one pass.
+    Busy time is fetched once for the whole horizon; tasks then take the earliest
+    free slots before their deadline in earliest-deadline-first order (high priority
+    tasks counting as due PRIORITY_LEAD earlier), carving blocks out of one shared
+    list of gaps so no two tasks get the same slot.
+    """
+    user = crud.get_user(db, user_id)
+    if not user:
+        raise ValueError("User not found")
+    prefs = crud.get_preferences(db, user.id)
+    now = datetime.datetime.now(datetime.timezone.utc).astimezone()
+
+    def aware(deadline):
+        return deadline.replace(tzinfo=now.tzinfo) if deadline.tzinfo is None else deadline
+
+    tasks = [
+        task for task in db.query(models.Task).filter(
+            models.Task.user_id == user.id,
+            models.Task.is_completed == False,
+            models.Task.status.in_(["pending", "underplanned"])
+        ).all()
+        if task.deadline and aware(task.deadline) > now and (task.scheduled_minutes or 0) < task.total_required_time
+    ]
+    if not tasks:
+        return {"tasks": [], "scheduled_minutes": 0, "blocks_created": 0, "block_ids": [], "sync_status": None}
+
+    tasks.sort(key=lambda task: (aware(task.deadline) - PRIORITY_LEAD.get(task.priority, datetime.timedelta(0)), task.id))
+    horizon = max(aware(task.deadline) for task in tasks)
+
+    # One busy-time fetch (or cache lookup) for every task
+    _, free_gaps = get_free_time(user, now, horizon, db, prefs)
+    gaps = [[gap_start, gap_end] for gap_start, gap_end in free_gaps]
+
+    block_len = prefs.study_block_length
+    # Shared by all tasks, like the gaps: a day filled by one task is full for the next
+    daily_load = study_load(db, user.id, now, horizon)
+    planned = []  # (task, [blocks])
+
+    for task in tasks:
+        needed_minutes = task.total_required_time - (task.scheduled_minutes or 0)
+        task_blocks = allocate_blocks(task.id, gaps, needed_minutes, block_len, aware(task.deadline), daily_load, prefs.max_study_minutes_per_day)
+        planned.append((task, task_blocks))
+
+    new_blocks = [block for _, task_blocks in planned for block in task_blocks]
+
+    # Persist the whole run as one unit of work, like schedule_task
+    results = []
+    try:
+        db.add_all(new_blocks)
+        db.flush()  # block ids for the outbox rows
+
+        for task, task_blocks in planned:
+            if task_blocks and user.google_token:
+                summary = block_summary(task)
+                for block in task_blocks:
+                    calendar_outbox.enqueue_block_insert(db, user.id, block, summary, description="Auto-scheduled by Ultron")
+            scheduled = len(task_blocks) * block_len
+            task.scheduled_minutes = (task.scheduled_minutes or 0) + scheduled
+            task.status = "scheduled" if task.scheduled_minutes >= task.total_required_time else "underplanned"
+            results.append({
+                "task_id": task.id,
+                "title": task.title,
+                "scheduled_minutes": scheduled,
+                "blocks_created": len(task_blocks),
+                "status": task.status
+            })
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    calendar_outbox.wake()
+
+    return {
+        "tasks": results,
+        "scheduled_minutes": len(new_blocks) * block_len,
+        "blocks_created": len(new_blocks),
+        "block_ids": [block.id for block in new_blocks],
+        "sync_status": "pending" if new_blocks and user.google_token else None
+    }
+
+# Incremental re-planning looks for new slots this far around the changed interval
+REPLAN_WINDOW = datetime.timedelta(days=2)
+
+def _take_nearest_slot(gaps: list, wanted_start: datetime.datetime, duration: datetime.timedelta, latest_end: datetime.datetime, daily_load: dict, max_daily: int, minutes: int):
+    """
+    Finds the free slot of `duration` closest to wanted_start (ending by latest_end and fitting the
+    day's study budget), cuts it out of `gaps` and returns its start, or None if nothing fits.
+    """
+    best = None
+    for i, (gap_start, gap_end) in enumerate(gaps):
+        gap_end = min(gap_end, latest_end)
+        if gap_end - gap_start < duration:
+            continue
+        # The spot in this gap nearest to where the block was
+        start = min(max(wanted_start, gap_start), gap_end - duration)
+        if max_daily and daily_load.get(start.date(), 0) + minutes > max_daily:
+            continue
+        distance = abs(start - wanted_start)
+        if best is None or distance < best[0]:
+            best = (distance, i, start)
+    if best is None:
+        return None
+
+    _, i, start = best
+    gap_start, gap_end = gaps[i]
+    gaps[i:i + 1] = [piece for piece in ([gap_start, start], [start + duration, gap_end]) if piece[1] > piece[0]]
+    daily_load[start.date()] = daily_load.get(start.date(), 0) + minutes
+    return start
+
+def _relocate_blocks(db: Session, user: models.User, prefs: models.Preference, blocks: list, window_start: datetime.datetime, window_end: datetime.datetime, extra_busy: list = None):
+    """
+    Moves `blocks` (in the given order) to the free slots nearest their old times within
+    [window_start, window_end), before their task's deadline and within the daily study cap.
+    All of them share one gap list, so they never land on each other. Queues an outbox update
+    per moved block; does not commit. Returns (moves, ids of blocks that found no slot).
+    """
+    tz = window_start.tzinfo
+
+    def aware(dt):
+        return dt.replace(tzinfo=tz) if dt.tzinfo is None else dt.astimezone(tz)
+
+    def naive(dt):
+        # Block times are stored as naive local time
+        return dt.astimezone(tz).replace(tzinfo=None)
+
+    # Busy time in the window, minus the blocks being moved (their old slots are up for grabs),
+    # whether their events are confirmed or still queued inserts
+    moving_ids = {block.id for block in blocks}
+    moving_event_ids = {block.google_event_id for block in blocks if block.google_event_id}
+    moving_event_ids |= calendar_outbox.queued_insert_ids(db, user.id, moving_ids)
+    existing_events = [
+        event for event in get_events_for_range(user, window_start, window_end, db=db)
+        if event.get('google_event_id') not in moving_event_ids
+    ]
+    other_blocks = db.query(models.StudyBlock).join(models.Task).filter(
+        models.Task.user_id == user.id,
+        models.StudyBlock.google_event_id.is_(None),
+        models.StudyBlock.start_time < naive(window_end),
+        models.StudyBlock.end_time > naive(window_start)
+    ).all()
+    existing_events.extend(
+        {'start': aware(block.start_time), 'end': aware(block.end_time), 'title': "Study"}
+        for block in other_blocks if block.id not in moving_ids
+    )
+    existing_events.extend(extra_busy or [])
+
+    gaps = [[gap_start, gap_end] for gap_start, gap_end in calculate_free_gaps(window_start, window_end, existing_events, prefs)]
+    daily_load = study_load(db, user.id, window_start, window_end)
+
+    moved, unplaced = [], []
+    for block in blocks:
+        old_start, old_end = aware(block.start_time), aware(block.end_time)
+        duration = old_end - old_start
+        minutes = int(duration.total_seconds() // 60)
+        daily_load[old_start.date()] = daily_load.get(old_start.date(), 0) - minutes
+
+        latest_end = window_end
+        if block.task.deadline:
+            latest_end = min(latest_end, aware(block.task.deadline))
+        new_start = _take_nearest_slot(gaps, old_start, duration, latest_end, daily_load, prefs.max_study_minutes_per_day, minutes)
+        if new_start is None:
+            daily_load[old_start.date()] += minutes
+            unplaced.append(block.id)
+            continue
+        new_start = new_start.astimezone(tz)
+
+        block.start_time = naive(new_start)
+        block.end_time = naive(new_start + duration)
+        if user.google_token and (block.google_event_id or block.sync_status == "pending"):
+            calendar_outbox.enqueue_block_update(db, user.id, block)
+        moved.append({"block_id": block.id, "task_id": block.task_id, "old_start": old_start, "new_start": new_start})
+    return moved, unplaced
+
+def replan_interval(db: Session, user_id: int, change_start: datetime.datetime, change_end: datetime.datetime):
+    """
+    Incremental re-planning after a calendar change: only the future StudyBlocks overlapping
+    [change_start, change_end) are moved, each to the free slot nearest its old time within
+    REPLAN_WINDOW (and before its task's deadline). Busy time is read for that window only,
+    and only the moved blocks are queued for Google Calendar.
+    Returns the moves, plus the blocks that found no slot (left where they are).
+    """
+    user = crud.get_user(db, user_id)
+    if not user:
+        raise ValueError("User not found")
+    prefs = crud.get_preferences(db, user.id)
+    now = datetime.datetime.now(datetime.timezone.utc).astimezone()
+    tz = now.tzinfo
+
+    def aware(dt):
+        return dt.replace(tzinfo=tz) if dt.tzinfo is None else dt.astimezone(tz)
+
+    # Block times are stored as naive local time
+    change_start, change_end = aware(change_start), aware(change_end)
+    affected = db.query(models.StudyBlock).join(models.Task).filter(
+        models.Task.user_id == user.id,
+        models.Task.is_completed == False,
+        models.StudyBlock.start_time < change_end.replace(tzinfo=None),
+        models.StudyBlock.end_time > change_start.replace(tzinfo=None),
+        # Blocks already under way stay put
+        models.StudyBlock.start_time > now.replace(tzinfo=None)
+    ).order_by(models.StudyBlock.start_time).all()
+    if not affected:
+        return {"moved": [], "unplaced": []}
+
+    # The change itself counts as busy, in case the calendar does not show it yet
+    moved, unplaced = _relocate_blocks(
+        db, user, prefs, affected,
+        max(now, change_start - REPLAN_WINDOW), change_end + REPLAN_WINDOW,
+        extra_busy=[{'start': change_start, 'end': change_end, 'title': "Busy"}]
+    )
     db.commit()
-    
-    return {"scheduled_minutes": scheduled_count, "blocks_created": len(new_blocks)}
+    if moved:
+        calendar_outbox.wake()
+    return {"moved": moved, "unplaced": unplaced}
+
+def resolve_conflicts(db: Session, user_id: int):
+    """
+    Moves every conflicting StudyBlock (see check_conflicts) in one pass: blocks are re-placed
+    together on one shared list of gaps between now and the latest of their deadlines, most
+    urgent task first, each as close to its old time as possible and within the daily study cap.
+    All moves are committed at once and reach Google Calendar in one outbox batch.
+    """
+    user = crud.get_user(db, user_id)
+    if not user:
+        raise ValueError("User not found")
+    prefs = crud.get_preferences(db, user.id)
+    conflicts = check_conflicts(db, user.id)
+    if not conflicts:
+        return {"conflicts": 0, "moved": [], "unplaced": []}
+
+    now = datetime.datetime.now(datetime.timezone.utc).astimezone()
+    tz = now.tzinfo
+
+    def aware(dt):
+        return dt.replace(tzinfo=tz) if dt.tzinfo is None else dt.astimezone(tz)
+
+    blocks = {}
+    for conflict in conflicts:
+        if conflict["block_id"] not in blocks:
+            blocks[conflict["block_id"]] = crud.get_study_block(db, conflict["block_id"])
+    # Don't move a block that is already under way
+    blocks = [block for block in blocks.values() if aware(block.start_time) > now]
+    if not blocks:
+        return {"conflicts": len(conflicts), "moved": [], "unplaced": []}
+
+    def due(block):
+        return aware(block.task.deadline) if block.task.deadline else aware(block.end_time) + REPLAN_WINDOW
+
+    blocks.sort(key=lambda block: (due(block), block.start_time))
+    window_end = max(due(block) for block in blocks)
+
+    moved, unplaced = _relocate_blocks(db, user, prefs, blocks, now, window_end)
+    db.commit()
+    if moved:
+        calendar_outbox.wake()
+    return {"conflicts": len(conflicts), "moved": moved, "unplaced": unplaced}
+
+def find_overlaps(blocks: list, events: list):
+    """
+    Sweep line over two lists of {'start', 'end', ...} dicts: returns every (block, event) pair
+    that overlaps, in block start order. Both lists are sorted once and swept together with
+    the currently open intervals kept in end-time heaps: O((B + E) log(B + E) + overlaps).
+    """
+    points = sorted(
+        [(item['start'], 0, i) for i, item in enumerate(blocks) if item['end'] > item['start']] +
+        [(item['start'], 1, i) for i, item in enumerate(events) if item['end'] > item['start']]
+    )
+    open_blocks, open_events = [], []  # heaps of (end, index)
+    pairs = []
+    for start, kind, i in points:
+        # Whatever ended by now cannot overlap anything that starts now or later
+        while open_blocks and open_blocks[0][0] <= start:
+            heapq.heappop(open_blocks)
+        while open_events and open_events[0][0] <= start:
+            heapq.heappop(open_events)
+        if kind == 0:
+            pairs.extend((i, j) for _, j in open_events)
+            heapq.heappush(open_blocks, (blocks[i]['end'], i))
+        else:
+            pairs.extend((j, i) for _, j in open_blocks)
+            heapq.heappush(open_events, (events[i]['end'], i))
+    pairs.sort(key=lambda pair: (blocks[pair[0]]['start'], events[pair[1]]['start']))
+    return [(blocks[i], events[j]) for i, j in pairs]
 
 def check_conflicts(db: Session, user_id: int):
     """
-    Checks for overlaps between StudyBlocks and Google Calendar events.
-    Returns a list of conflicting StudyBlocks.
+    Checks for overlaps between the user's future StudyBlocks and everything else on their
+    calendar (Google events from every selected calendar, fixed schedules, commute, dinner).
+    The blocks' own Google events are excluded by google_event_id (or, while the insert
+    is still queued, by the outbox row's idempotency key).
+    Returns one dict per overlapping (block, event) pair, in block start order.
     """
     user = crud.get_user(db, user_id)
-    if not user or not user.google_token:
+    if not user:
         return []
-        
-    # Get all future study blocks
+
     now = datetime.datetime.now(datetime.timezone.utc).astimezone()
-    future_blocks = db.query(models.StudyBlock).filter(models.StudyBlock.start_time >= now).all()
-    
+    tz = now.tzinfo
+    # Blocks of completed tasks are not re-planned (see replan_interval), so they are no conflicts either
+    future_blocks = db.query(models.StudyBlock).join(models.Task).filter(
+        models.Task.user_id == user.id,
+        models.Task.is_completed == False,
+        models.StudyBlock.end_time > now.replace(tzinfo=None)
+    ).all()
     if not future_blocks:
         return []
-        
-    # Determine range to fetch from Google
-    end_time = max(b.end_time for b in future_blocks)
-    
-    # Fetch Google Events
-    # Note: This fetches ALL events, including the ones we created.
-    google_events = get_events_for_range(user, now, end_time)
-    
+
+    # Block times are stored as naive local time
+    block_items = [{
+        'start': block.start_time.replace(tzinfo=tz),
+        'end': block.end_time.replace(tzinfo=tz),
+        'block': block
+    } for block in future_blocks]
+    end_time = max(item['end'] for item in block_items)
+
+    # Every study block's own event (this block's or another's) is not an outside conflict,
+    # including events of inserts that reached Google before the block got its google_event_id
+    own_event_ids = {
+        event_id for (event_id,) in db.query(models.StudyBlock.google_event_id).join(models.Task).filter(
+            models.Task.user_id == user.id,
+            models.StudyBlock.google_event_id.isnot(None)
+        )
+    } | calendar_outbox.queued_insert_ids(db, user.id)
+    events = [
+        event for event in get_events_for_range(user, now, end_time, db=db)
+        if not event.get('google_event_id') or event['google_event_id'] not in own_event_ids
+    ]
+
     conflicts = []
-    
-    for block in future_blocks:
-        # Ensure block times are aware for comparison
-        b_start = block.start_time.replace(tzinfo=now.tzinfo) if block.start_time.tzinfo is None else block.start_time
-        b_end = block.end_time.replace(tzinfo=now.tzinfo) if block.end_time.tzinfo is None else block.end_time
-        
-        for event in google_events:
-            ev_start = event['start']
-            ev_end = event['end']
-            # Check overlap
-            if ev_end > b_start and ev_start < b_end:
-                # It overlaps. Is it the SAME event?
-                # We don't have the Google Event ID in the normalized list easily available in get_events_for_range
-                # We need to modify get_events_for_range to return IDs too.
-                pass 
-                
-    return [] # Placeholder until we fix get_events_for_range
+    for item, event in find_overlaps(block_items, events):
+        block = item['block']
+        overlap = min(item['end'], event['end']) - max(item['start'], event['start'])
+        conflicts.append({
+            "block_id": block.id,
+            "task_id": block.task_id,
+            "task_title": block.task.title if block.task else None,
+            "block_start": item['start'],
+            "block_end": item['end'],
+            "event_title": event.get('title', 'Busy'),
+            "event_start": event['start'],
+            "event_end": event['end'],
+            "google_event_id": event.get('google_event_id'),
+            "source": event.get('source', 'local'),
+            "overlap_minutes": int(overlap.total_seconds() // 60)
+        })
+    return conflicts
 
 def reschedule_block(db: Session, block_id: int, new_start_time: datetime.datetime):
     """
     Moves a specific study block to a new time.
-    Updates both DB and Google Calendar.
+    Updates the DB and queues the Google Calendar change (see calendar_outbox).
     """
     block = crud.get_study_block(db, block_id)
     if not block:
@@ -389,25 +866,17 @@ def reschedule_block(db: Session, block_id: int, new_start_time: datetime.dateti
     # Calculate duration to keep it constant
     duration = block.end_time - block.start_time
     
-    # Update DB
+    # Update DB, queueing the Google Calendar change in the same transaction
+    # (a still-queued insert picks up the new times by itself)
     block.start_time = new_start_time
     block.end_time = new_start_time + duration
+    
+    user = block.task.user
+    if user.google_token and (block.google_event_id or block.sync_status == "pending"):
+        calendar_outbox.enqueue_block_update(db, user.id, block)
+        
     db.commit()
     db.refresh(block)
+    calendar_outbox.wake()
     
-    # Update Google Calendar
-    if block.google_event_id:
-        task = block.task
-        user = task.user
-        if user.google_token:
-            try:
-                calendar_integration.update_event(
-                    user.google_token,
-                    event_id=block.google_event_id,
-                    start_time=block.start_time,
-                    end_time=block.end_time
-                )
-            except Exception as e:
-                print(f"Failed to update Google Calendar event: {e}")
-                
     return block
@@ -0,0 +1,106 @@
+import datetime
+import threading
+from collections import namedtuple
+from sqlalchemy.orm import Session
+import models
+
+# Fixed schedules and the commute/dinner preferences compiled into one
+# immutable template per weekday, as minute offsets from midnight.
+# get_events_for_range used to re-parse every "HH:MM" string for every day of
+# the range; with the template, expanding a range only stamps offsets onto dates.
+# Templates are cached per user; crud drops a user's template whenever their
+# fixed schedules or preferences change.
+
+DAY_MAP = {
+    "Monday": 0, "Tuesday": 1, "Wednesday": 2, "Thursday": 3,
+    "Friday": 4, "Saturday": 5, "Sunday": 6
+}
+
+# Categories that mean being on campus (and so commuting there and back)
+CAMPUS_CATEGORIES = ("university", "work")
+
+DEFAULT_COMMUTE_MINS = 90
+DINNER_MINS = 60
+
+# One weekday: fixed blocks as (start, end, title) minute offsets, plus the campus envelope (None without campus blocks)
+DayTemplate = namedtuple("DayTemplate", ["blocks", "campus_start", "campus_end"])
+
+# days: one DayTemplate per weekday (Monday=0); dinner_start is None when no dinner time is set
+WeeklyTemplate = namedtuple("WeeklyTemplate", ["days", "commute_mins", "dinner_start"])
+
+_cache = {}
+_cache_lock = threading.Lock()
+_generation = 0  # bumped by invalidate(), so a compile that raced an invalidation is not cached
+
+
+def to_minutes(time_str):
+    """'HH:MM' -> minutes since midnight."""
+    parsed = datetime.datetime.strptime(time_str, "%H:%M")
+    return parsed.hour * 60 + parsed.minute
+
+def compile_template(fixed_schedules, preferences):
+    """Builds the WeeklyTemplate for a user's fixed schedules and preferences."""
+    blocks = [[] for _ in range(7)]
+    for schedule in fixed_schedules:
+        weekday = DAY_MAP.get(schedule.day_of_week)
+        if weekday is None:
+            continue
+        blocks[weekday].append((
+            to_minutes(schedule.start_time),
+            to_minutes(schedule.end_time),
+            schedule.title,
+            schedule.category in CAMPUS_CATEGORIES
+        ))
+
+    days = []
+    for day_blocks in blocks:
+        campus = [(start, end) for start, end, _, is_campus in day_blocks if is_campus]
+        days.append(DayTemplate(
+            blocks=tuple((start, end, title) for start, end, title, _ in day_blocks),
+            campus_start=min(start for start, _ in campus) if campus else None,
+            campus_end=max(end for _, end in campus) if campus else None
+        ))
+
+    commute_mins = DEFAULT_COMMUTE_MINS
+    dinner_start = None
+    if preferences:
+        commute_mins = preferences.commute_duration_mins or DEFAULT_COMMUTE_MINS
+        if preferences.dinner_time:
+            dinner_start = to_minutes(preferences.dinner_time)
+    return WeeklyTemplate(days=tuple(days), commute_mins=commute_mins, dinner_start=dinner_start)
+
+def _preferences_key(preferences):
+    if not preferences:
+        return None
+    return (preferences.commute_duration_mins, preferences.dinner_time)
+
+def get_template(db: Session, user: models.User):
+    """Returns the user's compiled template, compiling (and caching) it on first use."""
+    # The preferences are loaded anyway, so a change made behind crud's back is caught too
+    preferences_key = _preferences_key(user.preferences)
+    with _cache_lock:
+        cached = _cache.get(user.id)
+        generation = _generation
+    if cached is not None and cached[0] == preferences_key:
+        return cached[1]
+
+    fixed_schedules = db.query(models.FixedSchedule).filter(models.FixedSchedule.user_id == user.id).all()
+    template = compile_template(fixed_schedules, user.preferences)
+    with _cache_lock:
+        if generation == _generation:
+            _cache[user.id] = (preferences_key, template)
+    return template
+
+def invalidate(user_id: int = None):
+    """Drops a user's compiled template (or every user's), e.g. after their fixed schedules or preferences change."""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+
+def day_start(day: datetime.date, tz):
+    """Midnight of `day` in tz; template offsets are added to this."""
+    return datetime.datetime.combine(day, datetime.time()).replace(tzinfo=tz)